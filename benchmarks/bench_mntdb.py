@@ -0,0 +1,78 @@
+'''
+Benchmarks memory footprint and decode/encode time of the mount database at
+1k/10k/100k volumes, with the legacy key-matching decoder as a reference.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_mntdb
+'''
+
+import json
+import time
+import tracemalloc
+
+from easyfuse.MountDatabase import (DatabaseJSONDecoder, DatabaseJSONEncoder,
+                                    MountOptions, VolumeSpec)
+
+
+class LegacyJSONDecoder(json.JSONDecoder):
+    """
+    The original decoder, matching the keys of every decoded object against
+    the dataclass annotations.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(object_hook=self._object_hook, **kwargs)
+
+    def _object_hook(self, obj: dict):
+        if VolumeSpec.__annotations__.keys() == obj.keys():
+            return VolumeSpec(**obj)
+        elif MountOptions.__annotations__.keys() == obj.keys():
+            return MountOptions(**obj)
+        return obj
+
+
+def _catalog(size: int) -> str:
+    db = {
+        f'volume{i}': VolumeSpec(
+            f'volume{i}', [f'{i:064x}'] if i % 3 == 0 else [],
+            MountOptions(device=f'sshfs#user@host{i % 16}:/srv/volume{i}',
+                         opts='allow_other,reconnect,uid=1000,gid=1000'),
+            i % 3 == 0)
+        for i in range(size)
+    }
+    return DatabaseJSONEncoder().encode(db)
+
+
+def _measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, current
+
+
+def main():
+    decoder = DatabaseJSONDecoder()
+    legacy = LegacyJSONDecoder()
+    encoder = DatabaseJSONEncoder()
+    print(f"{'volumes':>8} {'json [MiB]':>11} {'raw [ms]':>9} "
+          f"{'raw [MiB]':>10} {'legacy [ms]':>12} {'decode [ms]':>12} "
+          f"{'decoded [MiB]':>14} {'encode [ms]':>12}")
+    for size in (1000, 10000, 100000):
+        s = _catalog(size)
+        raw, raw_time, raw_mem = _measure(json.loads, s)
+        del raw
+        old, legacy_time, _ = _measure(legacy.decode, s)
+        del old
+        db, decode_time, decode_mem = _measure(decoder.decode, s)
+        _, encode_time, _ = _measure(encoder.encode, db)
+        print(f"{size:>8} {len(s) / 2**20:>11.2f} {raw_time * 1e3:>9.1f} "
+              f"{raw_mem / 2**20:>10.2f} {legacy_time * 1e3:>12.1f} "
+              f"{decode_time * 1e3:>12.1f} {decode_mem / 2**20:>14.2f} "
+              f"{encode_time * 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Benchmarks command template expansion with wide, multi-line option sets.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parse_command
+'''
+
+import itertools
+import time
+import tracemalloc
+
+from easyfuse.parse_command import iter_command, parse_command, ParserError
+
+TEMPLATE = 'mount -t {driver} [-o {opts} -o {extra}] {device} {target}'
+
+
+def _mapping(opts_lines: int, extra_lines: int):
+    return {
+        'driver': 'fuse',
+        'opts': '\n'.join(f'option{i}=value{i}' for i in range(opts_lines)),
+        'extra': '\n'.join(f'extra{i}' for i in range(extra_lines)),
+        'device': 'sshfs#user@host:/path',
+        'target': '/run/easyfuse/mntpt/volume',
+    }
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except ParserError as e:
+        result = e
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    print(f"{'lines':>11} {'mode':>14} {'tokens':>9} {'time [ms]':>10} "
+          f"{'peak [KiB]':>11}")
+    for opts_lines, extra_lines in ((10, 10), (100, 10), (100, 100),
+                                    (300, 300)):
+        mapping = _mapping(opts_lines, extra_lines)
+        runs = (
+            ('list', lambda: parse_command(TEMPLATE, mapping)),
+            ('capped', lambda: parse_command(
+                TEMPLATE, mapping, max_tokens=4096, max_bytes=256 * 1024)),
+            ('stream-first', lambda: list(
+                itertools.islice(iter_command(TEMPLATE, mapping), 16))),
+        )
+        for mode, fn in runs:
+            result, elapsed, peak = _measure(fn)
+            tokens = len(result) if isinstance(result, list) else 'cap'
+            print(f"{opts_lines:>5}x{extra_lines:<5} {mode:>14} "
+                  f"{tokens:>9} {elapsed * 1e3:>10.2f} {peak / 1024:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
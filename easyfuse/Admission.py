@@ -0,0 +1,107 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import asyncio
+import collections
+
+# Can be removed >= Python 3.9
+from typing import Deque
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class Limiter:
+    """
+    Concurrency limiter with a bounded, deadline-aware wait queue.
+
+    At most `concurrency` callers hold a slot at a time and at most
+    `queue_size` wait for one. A caller is rejected up front when the queue
+    is full, or when the estimated wait (from a moving average of slot hold
+    times) would not leave it enough time to finish within its timeout.
+    """
+    def __init__(self,
+                 name: str,
+                 concurrency: int,
+                 queue_size: int,
+                 alpha: float = 0.2):
+        if concurrency < 1:
+            raise ValueError(f"{name}: concurrency must be at least 1, "
+                             f"got {concurrency}")
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.alpha = alpha
+        self.active = 0
+        self.service_time = 0.0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def estimate_wait(self) -> float:
+        return (self.queued + 1) / self.concurrency * self.service_time
+
+    async def acquire(self, timeout: float):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        if self.queued >= self.queue_size:
+            raise AdmissionError(
+                f"{self.name}: too many pending requests, retry later.")
+        budget = timeout - self.service_time
+        if self.estimate_wait() > budget:
+            raise AdmissionError(
+                f"{self.name}: expected wait of {self.estimate_wait():.1f}s "
+                f"exceeds the {timeout:.0f}s deadline, retry later.")
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), budget)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # the slot was handed over right at the deadline
+                return
+            self._waiters.remove(waiter)
+            raise AdmissionError(
+                f"{self.name}: no slot within {budget:.1f}s, retry later.")
+        except asyncio.CancelledError:
+            if waiter.done():
+                self._hand_over()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, held: float):
+        self.service_time += self.alpha * (held - self.service_time)
+        self._hand_over()
+
+    def _hand_over(self):
+        if self._waiters:
+            # hand the slot over directly, so it cannot be overtaken
+            self._waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+    def collect(self):
+        labels = {"endpoint": self.name}
+        yield ("easyfuse_requests_active", labels, self.active)
+        yield ("easyfuse_requests_queued", labels, self.queued)
+        yield ("easyfuse_request_service_seconds", labels, self.service_time)
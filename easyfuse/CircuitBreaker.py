@@ -0,0 +1,170 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import dataclasses
+import random
+import re
+import time
+
+# Can be removed >= Python 3.9
+from typing import Dict
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+_HOST = r'(\[[^\]]*\]|[^:/\[]*)'
+_ENDPOINT_PATTERNS = [
+    # proto://[user@]host[:port]/path
+    re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/]*@)?' + _HOST),
+    # //host/share
+    re.compile(r'^//' + _HOST),
+    # [user@]host:path
+    re.compile(r'^(?:[^@/:]*@)?' + _HOST + ':'),
+]
+
+
+def device_endpoint(device: str) -> str:
+    """
+    Extracts the remote host from a mount device specification, e.g.
+    `sshfs#user@host:/path` -> `host`, `//host/share` -> `host`,
+    `proto://user@host:port/path` -> `host`. Devices without a recognizable
+    host (e.g. rclone remotes) are keyed by the device string itself.
+    """
+    device = device.split('#', 1)[-1]
+    m = None
+    for pattern in _ENDPOINT_PATTERNS:
+        m = pattern.match(device)
+        if m:
+            break
+    if not m or not m.group(1):
+        return device
+    return m.group(1).strip('[]')
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    attempts: int = 1
+    backoff: float = 0.5
+    backoff_max: float = 10.0
+
+    def __post_init__(self):
+        if self.attempts < 1:
+            raise ValueError(
+                f"at least one attempt is required, got {self.attempts}")
+
+    def delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter for the given (0-based) retry.
+        """
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker. After `threshold` consecutive
+    failures the breaker opens and rejects calls for `reset_timeout` seconds,
+    then lets a single probe through (half-open) to decide whether to close
+    again.
+    """
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: float = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(
+            0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self):
+        """
+        Frees the half-open probe slot taken by `allow`, whatever the outcome
+        of the call was (including cancellation).
+        """
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.threshold and (self.failures >= self.threshold
+                               or self._opened_at is not None):
+            self._opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        return {
+            "State": self.state,
+            "Failures": self.failures,
+            "RetryIn": round(self.retry_in(), 3),
+        }
+
+
+class CircuitBreakers:
+    """
+    Registry of circuit breakers keyed by endpoint, created on demand.
+    """
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def __getitem__(self, endpoint: str) -> CircuitBreaker:
+        try:
+            return self._breakers[endpoint]
+        except KeyError:
+            breaker = CircuitBreaker(self.threshold, self.reset_timeout)
+            self._breakers[endpoint] = breaker
+            return breaker
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        return self._breakers.get(endpoint)
+
+    def collect(self):
+        for endpoint, breaker in self._breakers.items():
+            labels = {"endpoint": endpoint}
+            yield ("easyfuse_breaker_state", labels,
+                   STATE_VALUES[breaker.state])
+            yield ("easyfuse_breaker_failures", labels, breaker.failures)
@@ -16,30 +16,156 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
+import logging
 import os
 import subprocess
+import time
 
 # Can be removed >= Python 3.9
-from typing import Dict, Union
+from typing import Dict, List, Set, Union
 
+from . import Events
+from .CircuitBreaker import CircuitBreakers, RetryPolicy, device_endpoint
+from .Metrics import Metrics
 from .MountDatabase import MountDatabase, VolumeSpec, MountOptions
-from .parse_command import parse_command, MappingType
+from .mountinfo import kernel_path, read_mountinfo
+from .ResourceMonitor import ResourceMonitor
+from .parse_command import parse_command, MappingType, ParserError
+
+
+logger = logging.getLogger(__name__)
+
+READY_CHECKS = ('none', 'mount', 'statfs')
+LAYOUTS = ('flat', 'hashed')
+# threads for statfs ready checks, which block on a hung FUSE server
+STATFS_PROBES = 4
 
 
 class DriverError(Exception):
     pass
 
 
+def layout_path(mntpath: str, layout: str, name: str) -> str:
+    if layout == 'hashed':
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return os.path.join(mntpath, digest[:2], digest[2:4], name)
+    return os.path.join(mntpath, name)
+
+
+def volume_path(mntpath: str, layout: str, vol: VolumeSpec) -> str:
+    """
+    Where `vol` is mounted, or would be mounted under the given layout.
+    Volumes mounted before mount points were recorded are mounted at their
+    flat location.
+    """
+    if vol.is_mounted:
+        return vol.mountpoint or os.path.join(mntpath, vol.name)
+    return layout_path(mntpath, layout, vol.name)
+
+
+def command_mapping(vol: VolumeSpec, target: str) -> MappingType:
+    return {
+        "opts": vol.opts.opts,
+        "driver": vol.opts.driver,
+        "target": target,
+        "device": vol.opts.device,
+    }
+
+
+def ready_opts(opts: MountOptions, check: str, timeout: float):
+    """
+    Returns the ready check and timeout of a volume, falling back to the
+    given defaults.
+    """
+    check = opts.ready or check
+    if check not in READY_CHECKS:
+        raise DriverError(f"Invalid ready check {check}, "
+                          f"allowed options are {', '.join(READY_CHECKS)}")
+    try:
+        timeout = float(opts.ready_timeout or timeout)
+    except ValueError:
+        raise DriverError(f"Invalid ready_timeout {opts.ready_timeout}")
+    return check, timeout
+
+
 class Driver:
     def __init__(self, opts):
         self.mntpath = opts.mntpt
         self.mntdb = MountDatabase(opts.mntdb)
+        self.layout = getattr(opts, 'mntpt_layout', 'flat')
+        if self.layout not in LAYOUTS:
+            raise DriverError(f"Invalid mount point layout {self.layout}, "
+                              f"allowed options are {', '.join(LAYOUTS)}")
+        self.metrics = Metrics()
+        self.retry = RetryPolicy(
+            attempts=getattr(opts, 'mount_retries', 0) + 1,
+            backoff=getattr(opts, 'retry_backoff', 0.5),
+            backoff_max=getattr(opts, 'retry_backoff_max', 10.0))
+        self.breakers = CircuitBreakers(
+            threshold=getattr(opts, 'breaker_threshold', 0),
+            reset_timeout=getattr(opts, 'breaker_reset', 30.0))
+        self.metrics.add_collector(self.breakers.collect)
+        self.max_argv_tokens = getattr(opts, 'max_argv_tokens', None)
+        self.max_argv_bytes = getattr(opts, 'max_argv_bytes', None)
+        self.ready_check = getattr(opts, 'ready_check', 'none')
+        self.ready_timeout = getattr(opts, 'ready_timeout', 10.0)
+        self.events = Events.EventBus(getattr(opts, 'events_queue_size', 256))
+        self.resources = ResourceMonitor(self.mntpath)
+        self.metrics.add_collector(self.resources.collect)
+        self.draining = False
+        self._inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._mounting: Dict[str, asyncio.Future] = {}
+        self._statfs_pool = concurrent.futures.ThreadPoolExecutor(
+            STATFS_PROBES, thread_name_prefix='easyfuse-statfs')
+        self._statfs_probes: Set[concurrent.futures.Future] = set()
         dbpath = os.path.dirname(opts.mntdb)
         os.makedirs(self.mntpath, mode=0o777, exist_ok=True)
         os.makedirs(dbpath, mode=0o777, exist_ok=True)
+        self._pinned = self._find_pinned(self.mntdb.snapshot())
+
+    def _find_pinned(self, db: Dict[str, VolumeSpec]) -> Dict[str, str]:
+        """
+        Volumes that are mounted somewhere else than the current layout puts
+        them (e.g. after the layout was changed) stay pinned to their actual
+        mount point until they are unmounted.
+        """
+        pinned = {}
+        for name, vol in db.items():
+            if not vol.is_mounted:
+                continue
+            mountpoint = volume_path(self.mntpath, self.layout, vol)
+            if mountpoint != layout_path(self.mntpath, self.layout, name):
+                pinned[name] = mountpoint
+        if pinned:
+            logger.info(f"{len(pinned)} mounted volume(s) kept at their "
+                        f"current mount point until unmounted")
+        return pinned
 
     def get_path_for(self, name: str):
-        return os.path.join(self.mntpath, name)
+        try:
+            return self._pinned[name]
+        except KeyError:
+            return layout_path(self.mntpath, self.layout, name)
+
+    def _remove_mountpoint(self, name: str):
+        path = self.get_path_for(name)
+        os.rmdir(path)
+        # clean up the (now possibly empty) fan-out directories
+        root = os.path.normpath(self.mntpath)
+        parent = os.path.dirname(os.path.normpath(path))
+        while parent.startswith(root + os.sep):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        self._pinned.pop(name, None)
 
     async def is_mounted(self, name):
         async with self.mntdb:
@@ -48,6 +174,22 @@ class Driver:
             except KeyError:
                 raise DriverError(f"Volume {name} not found.")
 
+    async def volume_status(self, name) -> dict:
+        async with self.mntdb:
+            try:
+                vol = self.mntdb[name]
+            except KeyError:
+                raise DriverError(f"Volume {name} not found.")
+            status = {"Mounted": vol.is_mounted}
+            endpoint = device_endpoint(vol.opts.device)
+            breaker = self.breakers.get(endpoint)
+            if breaker is not None:
+                status["Breaker"] = dict(Endpoint=endpoint, **breaker.status())
+            stats = self.resources.get(self.get_path_for(name))
+            if vol.is_mounted and stats is not None:
+                status["Resources"] = stats.status()
+            return status
+
     @property
     async def volumes(self):
         """
@@ -56,48 +198,292 @@ class Driver:
         async with self.mntdb:
             return {key: self.mntdb[key] for key in self.mntdb.keys()}
 
+    @contextlib.contextmanager
+    def _operation(self):
+        """
+        Tracks a state-changing operation, so that shutdown can wait for it.
+        """
+        self._inflight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._inflight -= 1
+            if not self._inflight:
+                self._idle.set()
+
     async def volume_create(self, name: str, opts: dict):
+        with self._operation():
+            await self._volume_create(name, opts)
+
+    async def _volume_create(self, name: str, opts: dict):
         async with self.mntdb:
             if name in self.mntdb:
                 raise DriverError(
                     f"Volume {name} already exist, remove it first.")
             mount_opts = MountOptions(**opts)
+            self._ready_opts(mount_opts)
             self.mntdb[name] = VolumeSpec(name, [], mount_opts)
+            self.events.publish(Events.CREATED, name)
 
     async def volume_remove(self, name: str):
+        with self._operation():
+            await self._volume_remove(name)
+
+    async def _volume_remove(self, name: str):
         async with self.mntdb:
+            if name in self._mounting:
+                raise DriverError(
+                    f"Volume {name} is being mounted, retry later.")
             try:
                 del self.mntdb[name]
             except KeyError:
                 raise DriverError(f"Volume {name} not found.")
+            self._pinned.pop(name, None)
+            self.events.publish(Events.REMOVED, name)
 
     def _get_opts(self, vol) -> MappingType:
-        return {
-            "opts": vol.opts.opts,
-            "driver": vol.opts.driver,
-            "target": self.get_path_for(vol.name),
-            "device": vol.opts.device,
+        return command_mapping(vol, self.get_path_for(vol.name))
+
+    def _parse_command(self, command: str, vol: VolumeSpec) -> List[str]:
+        return parse_command(command,
+                             self._get_opts(vol),
+                             max_tokens=self.max_argv_tokens,
+                             max_bytes=self.max_argv_bytes)
+
+    def _ready_opts(self, opts: MountOptions):
+        return ready_opts(opts, self.ready_check, self.ready_timeout)
+
+    @staticmethod
+    def _is_ready(target: str, driver: str, statfs: bool) -> bool:
+        """
+        Checks (blocking) whether `target` is in the kernel mount table with
+        a file system type matching `driver` (e.g. fuse -> fuse.sshfs), and
+        optionally whether the file system answers statfs.
+        """
+        for entry in read_mountinfo():
+            if entry.mount_point == target and (
+                    entry.fstype == driver
+                    or entry.fstype.startswith(driver + '.')
+                    or entry.fstype.endswith('.' + driver)):
+                break
+        else:
+            return False
+        if statfs:
+            try:
+                os.statvfs(target)
+            except OSError:
+                return False
+        return True
+
+    async def _wait_ready(self, vol: VolumeSpec):
+        """
+        Polls, off the event loop and with growing delays, until the volume
+        passes its ready check or its ready_timeout expires.
+        """
+        check, timeout = self._ready_opts(vol.opts)
+        if check == 'none':
+            return
+        # as in mountinfo, e.g. for a --mntpt below a symbolic link
+        target = kernel_path(self.get_path_for(vol.name))
+        start = time.monotonic()
+        deadline = start + timeout
+        delay = 0.005
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and await asyncio.wait_for(
+                        self._probe_ready(target, vol.opts.driver,
+                                          check == 'statfs'), remaining):
+                    break
+            except asyncio.TimeoutError:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.metrics.inc("easyfuse_mount_ready_timeouts_total")
+                raise DriverError(f"Volume {vol.name} not ready after "
+                                  f"{timeout}s ({check} check).")
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+        elapsed = time.monotonic() - start
+        self.metrics.observe("easyfuse_mount_ready_seconds", elapsed)
+        logger.debug(f"Volume {vol.name} ready after {elapsed:.3f}s")
+
+    async def _probe_ready(self, target: str, driver: str,
+                           statfs: bool) -> bool:
+        """
+        Runs a single ready check off the event loop. statfs checks run in a
+        dedicated pool, so that the ones stuck on a dead remote (which
+        `wait_for` abandons, but cannot stop) do not use up the default
+        executor; while all of its threads are stuck, no new statfs check is
+        started and the volume counts as not ready.
+        """
+        if not statfs:
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self._is_ready, target, driver, False)
+        self._statfs_probes = {
+            probe
+            for probe in self._statfs_probes if not probe.done()
         }
+        if len(self._statfs_probes) >= STATFS_PROBES:
+            logger.warning(f"All {STATFS_PROBES} statfs checks are stuck, "
+                           f"not checking {target}")
+            return False
+        probe = self._statfs_pool.submit(self._is_ready, target, driver, True)
+        self._statfs_probes.add(probe)
+        return await asyncio.wrap_future(probe)
+
+    async def _run_command(self, cmd: List[str]):
+        proc = await asyncio.create_subprocess_exec(*cmd)
+        try:
+            returncode = await proc.wait()
+        except asyncio.CancelledError:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+            # reap the killed process, so that it does not linger as a zombie
+            await asyncio.shield(proc.wait())
+            raise
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    async def _run_mount_command(self, vol: VolumeSpec, cmd: List[str]):
+        """
+        Runs the mount command, retrying with backoff as configured, guarded
+        by the circuit breaker of the device endpoint.
+        """
+        endpoint = device_endpoint(vol.opts.device)
+        breaker = self.breakers[endpoint]
+        for attempt in range(self.retry.attempts):
+            if not breaker.allow():
+                self.metrics.inc("easyfuse_mount_rejected_total",
+                                 endpoint=endpoint)
+                raise DriverError(
+                    f"Endpoint {endpoint} is unavailable (circuit open), "
+                    f"retry in {breaker.retry_in():.1f}s.")
+            if attempt:
+                delay = self.retry.delay(attempt - 1)
+                logger.info(f"Retrying mount of {vol.name} in {delay:.2f}s "
+                            f"({attempt}/{self.retry.attempts - 1})")
+                await asyncio.sleep(delay)
+            try:
+                await self._run_command(cmd)
+            except subprocess.CalledProcessError as e:
+                breaker.record_failure()
+                self.metrics.inc("easyfuse_mount_failures_total",
+                                 endpoint=endpoint)
+                error = e
+            else:
+                breaker.record_success()
+                return
+            finally:
+                breaker.release()
+        raise DriverError(error)
 
     async def volume_mount(self, name: str, vid: str):
-        async with self.mntdb:
+        if self.draining:
+            raise DriverError("easyfuse is shutting down, retry later.")
+        with self._operation():
+            await self._volume_mount(name, vid)
+
+    async def _volume_mount(self, name: str, vid: str):
+        """
+        The mount command, its retries and the ready check run without the
+        mntdb lock, so a slow or unreachable endpoint does not stall other
+        volumes; the volume is marked as mounting in the meantime, and
+        concurrent mounts of the same volume wait for that attempt and share
+        its outcome.
+        """
+        while True:
+            async with self.mntdb:
+                try:
+                    vol = self.mntdb[name]
+                except KeyError:
+                    raise DriverError(f"Volume {name} not found.")
+                pending = self._mounting.get(name)
+                if pending is None:
+                    if vol.is_mounted:
+                        self._attach(vol, vid)
+                        return
+                    cmd = self._parse_command(vol.opts.mount_command, vol)
+                    target = self.get_path_for(name)
+                    os.makedirs(target, mode=0o777, exist_ok=True)
+                    self._mounting[name] = (
+                        asyncio.get_event_loop().create_future())
+                    break
+            await asyncio.wait({pending})
+            if pending.result() is not None:
+                raise DriverError(str(pending.result()))
+        error = None
+        try:
+            start = time.monotonic()
             try:
-                vol = self.mntdb[name]
-            except KeyError:
-                raise DriverError(f"Volume {name} not found.")
-            if vid not in vol.instances:
-                vol.instances.append(vid)
-            if not vol.is_mounted:
-                mapping = self._get_opts(vol)
-                cmd = parse_command(vol.opts.mount_command, mapping)
-                os.makedirs(mapping['target'], mode=0o777, exist_ok=True)
+                await self._run_mount_command(vol, cmd)
                 try:
-                    subprocess.run(cmd, check=True)
-                except subprocess.CalledProcessError as e:
-                    raise DriverError(e)
+                    await self._wait_ready(vol)
+                except DriverError:
+                    await self._unmount_quietly(vol)
+                    raise
+            except DriverError as e:
+                with contextlib.suppress(OSError):
+                    self._remove_mountpoint(name)
+                self.events.publish(Events.MOUNT_FAILED,
+                                    name,
+                                    error=str(e),
+                                    duration=time.monotonic() - start)
+                raise
+            async with self.mntdb:
+                if name not in self.mntdb:
+                    # removed behind our back (e.g. by easyfuse db prune)
+                    await self._unmount_quietly(vol)
+                    raise DriverError(f"Volume {name} not found.")
+                vol = self.mntdb[name]
                 vol.is_mounted = True
+                vol.mountpoint = target
+                self.events.publish(Events.MOUNTED,
+                                    name,
+                                    duration=time.monotonic() - start)
+                self._attach(vol, vid)
+        except DriverError as e:
+            error = e
+            raise
+        finally:
+            # waiters retry only if this attempt was cancelled
+            self._mounting.pop(name).set_result(error)
+
+    def _attach(self, vol: VolumeSpec, vid: str):
+        if vid not in vol.instances:
+            vol.instances.append(vid)
+            self.events.publish(Events.ATTACHED, vol.name, id=vid)
+
+    async def _unmount(self, vol: VolumeSpec):
+        cmd = self._parse_command(vol.opts.unmount_command, vol)
+        start = time.monotonic()
+        try:
+            await self._run_command(cmd)
+        except subprocess.CalledProcessError as e:
+            raise DriverError(e)
+        self._remove_mountpoint(vol.name)
+        vol.is_mounted = False
+        vol.mountpoint = ''
+        self.events.publish(Events.UNMOUNTED,
+                            vol.name,
+                            duration=time.monotonic() - start)
+
+    async def _unmount_quietly(self, vol: VolumeSpec):
+        try:
+            cmd = self._parse_command(vol.opts.unmount_command, vol)
+            await self._run_command(cmd)
+        except (subprocess.CalledProcessError, ParserError, OSError) as e:
+            logger.warning(f"Failed to unmount {vol.name}: {e}")
+        # fails harmlessly if the volume is still mounted
+        with contextlib.suppress(OSError):
+            self._remove_mountpoint(vol.name)
 
     async def volume_unmount(self, name: str, vid: str):
+        with self._operation():
+            await self._volume_unmount(name, vid)
+
+    async def _volume_unmount(self, name: str, vid: str):
         async with self.mntdb:
             try:
                 vol = self.mntdb[name]
@@ -107,12 +493,75 @@ class Driver:
                 vol.instances.remove(vid)
             except KeyError:
                 raise DriverError(f"Volume ID {vid} not found.")
+            self.events.publish(Events.DETACHED, name, id=vid)
             if not vol.instances and vol.is_mounted:
-                mapping = self._get_opts(vol)
-                cmd = parse_command(vol.opts.unmount_command, mapping)
+                await self._unmount(vol)
+
+    async def shutdown(self, unmount_idle: bool, timeout: float):
+        """
+        Stops accepting new mounts and waits for in-flight operations.
+        Optionally unmounts, in parallel, volumes that are still mounted but
+        have no instances left. Everything, including waiting for the mntdb,
+        is bounded by `timeout` seconds; unmounts still running at the
+        deadline are killed and their volumes are left as mounted in the
+        mntdb.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        self.draining = True
+        self.resources.stop()
+        inflight = self._inflight
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown: {self._inflight} operation(s) still "
+                           f"in flight after {timeout}s")
+        unmounted, failed, timed_out = [], [], []
+        if unmount_idle:
+            try:
+                # an operation still in flight may hold the mntdb
+                await asyncio.wait_for(
+                    self.mntdb.__aenter__(),
+                    max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                logger.warning(f"Shutdown: mntdb still locked after "
+                               f"{timeout}s, not unmounting idle volumes")
+            else:
                 try:
-                    subprocess.run(cmd, check=True)
-                except subprocess.CalledProcessError as e:
-                    raise DriverError(e)
-                os.rmdir(mapping['target'])
-                vol.is_mounted = False
+                    await self._unmount_idle(deadline, unmounted, failed,
+                                             timed_out)
+                finally:
+                    await self.mntdb.__aexit__(None, None, None)
+        self._statfs_pool.shutdown(wait=False)
+        self.events.close()
+        logger.info(f"Shutdown finished in {time.monotonic() - start:.2f}s: "
+                    f"waited for {inflight} in-flight operation(s), "
+                    f"unmounted {len(unmounted)}, failed {len(failed)}, "
+                    f"timed out {len(timed_out)}")
+        return unmounted, failed, timed_out
+
+    async def _unmount_idle(self, deadline: float, unmounted: List[str],
+                            failed: List[str], timed_out: List[str]):
+        tasks = {
+            asyncio.ensure_future(self._unmount(self.mntdb[name])): name
+            for name in self.mntdb.keys() if self.mntdb[name].is_mounted
+            and not self.mntdb[name].instances
+        }
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(
+            tasks, timeout=max(0.0, deadline - time.monotonic()))
+        for task in pending:
+            task.cancel()
+            timed_out.append(tasks[task])
+        if pending:
+            # killed commands are reaped right away, unless stuck in the
+            # kernel (e.g. on a hung FUSE mount); do not wait for those
+            await asyncio.wait(pending, timeout=1.0)
+        for task in done:
+            if task.exception() is None:
+                unmounted.append(tasks[task])
+            else:
+                logger.error(f"Shutdown: unmounting {tasks[task]} failed: "
+                             f"{task.exception()}")
+                failed.append(tasks[task])
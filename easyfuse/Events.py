@@ -0,0 +1,153 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import asyncio
+import dataclasses
+import itertools
+import json
+import time
+
+# Can be removed >= Python 3.9
+from typing import Set
+
+CREATED = 'created'
+REMOVED = 'removed'
+ATTACHED = 'attached'
+DETACHED = 'detached'
+MOUNTED = 'mounted'
+UNMOUNTED = 'unmounted'
+MOUNT_FAILED = 'mount_failed'
+DROPPED = 'dropped'
+
+
+@dataclasses.dataclass
+class Event:
+    id: int
+    type: str
+    data: dict
+
+    def encode(self) -> bytes:
+        """
+        Serializes the event as a server-sent event, see
+        https://html.spec.whatwg.org/multipage/server-sent-events.html
+        """
+        return (f"id: {self.id}\n"
+                f"event: {self.type}\n"
+                f"data: {json.dumps(self.data)}\n\n").encode()
+
+
+class Subscription:
+    """
+    A single consumer of the event bus, backed by a bounded queue.
+
+    When the queue is full, new events are dropped instead of blocking the
+    publisher; as soon as there is room again, the consumer is told how many
+    it missed by a `dropped` event, so it knows to resynchronize with
+    VolumeDriver.List/Get.
+    """
+    def __init__(self, bus: 'EventBus', maxsize: int):
+        self._bus = bus
+        self._queue = asyncio.Queue(maxsize)
+        self._ended = False
+        self.dropped = 0
+
+    def _report_dropped(self):
+        if self.dropped and not self._queue.full():
+            self._queue.put_nowait(
+                Event(self._bus.next_id(), DROPPED, {
+                    "count": self.dropped,
+                    "time": time.time()
+                }))
+            self.dropped = 0
+
+    def put(self, event: Event):
+        if self._ended:
+            return
+        self._report_dropped()
+        if self.dropped:
+            # keep the order: nothing is queued before the dropped event
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self) -> Event:
+        """
+        Returns the next event, or None once the bus has been closed and all
+        queued events are consumed.
+        """
+        if self._ended and self._queue.empty():
+            return None
+        event = await self._queue.get()
+        self._report_dropped()
+        return event
+
+    def end(self):
+        """
+        Makes `get` return None once the queued events are consumed; no
+        queued event is discarded.
+        """
+        self._ended = True
+        self._report_dropped()
+        if not self._queue.full():
+            # wakes up a pending get
+            self._queue.put_nowait(None)
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class EventBus:
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscription] = set()
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, type: str, name: str, **data):
+        if not self._subscribers:
+            return
+        event = Event(self.next_id(), type,
+                      dict(name=name, time=time.time(), **data))
+        for subscription in self._subscribers:
+            subscription.put(event)
+
+    def close(self):
+        """
+        Ends all subscriptions; pending events are still delivered first.
+        """
+        for subscription in self._subscribers:
+            subscription.end()
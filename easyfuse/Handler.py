@@ -17,10 +17,14 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
 import aiohttp.web
+import asyncio
 import json
 import logging
+import time
 
+from .Admission import AdmissionError, Limiter
 from .Driver import Driver, DriverError
+from .MountDatabase import DatabaseError
 from .parse_command import ParserError
 
 logger = logging.getLogger(__name__)
@@ -31,8 +35,31 @@ def jsonify(obj, **kwargs):
 
 
 class Handler:
-    def __init__(self, driver: Driver):
+    def __init__(self,
+                 driver: Driver,
+                 keepalive: float = 15.0,
+                 request_timeout: float = 30.0,
+                 mount_concurrency: int = 4,
+                 catalog_concurrency: int = 8,
+                 queue_size: int = 64):
         self.driver = driver
+        self.keepalive = keepalive
+        self.request_timeout = request_timeout
+        # Mount/Unmount and catalog calls are admitted in separate lanes with
+        # per-endpoint limits; Activate, Path and Capabilities never queue.
+        self.limiters = {
+            endpoint: Limiter(endpoint, concurrency, queue_size)
+            for endpoint, concurrency in (
+                ('/VolumeDriver.Mount', mount_concurrency),
+                ('/VolumeDriver.Unmount', mount_concurrency),
+                ('/VolumeDriver.Create', catalog_concurrency),
+                ('/VolumeDriver.Remove', catalog_concurrency),
+                ('/VolumeDriver.Get', catalog_concurrency),
+                ('/VolumeDriver.List', catalog_concurrency),
+            )
+        }
+        for limiter in self.limiters.values():
+            self.driver.metrics.add_collector(limiter.collect)
 
     async def handle_plugin_activate(self, request: aiohttp.web.Request):
         return jsonify({"Implements": ["VolumeDriver"]})
@@ -47,7 +74,7 @@ class Handler:
             return jsonify({"Err": ""})
         except KeyError as e:
             return jsonify({"Err": f"Missing option: {e}"}, status=400)
-        except DriverError as e:
+        except (DriverError, DatabaseError) as e:
             return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_remove(self, request: aiohttp.web.Request):
@@ -59,7 +86,7 @@ class Handler:
             return jsonify({"Err": ""})
         except KeyError as e:
             return jsonify({"Err": f"Missing option: {e}"}, status=400)
-        except DriverError as e:
+        except (DriverError, DatabaseError) as e:
             return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_mount(self, request: aiohttp.web.Request):
@@ -75,7 +102,7 @@ class Handler:
             })
         except KeyError as e:
             return jsonify({"Err": f"Missing option: {e}"}, status=400)
-        except (DriverError, ParserError) as e:
+        except (DriverError, DatabaseError, ParserError) as e:
             return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_path(self, request: aiohttp.web.Request):
@@ -102,7 +129,7 @@ class Handler:
             return jsonify({"Err": ""})
         except KeyError as e:
             return jsonify({"Err": f"Missing option: {e}"}, status=400)
-        except (DriverError, ParserError) as e:
+        except (DriverError, DatabaseError, ParserError) as e:
             return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_get(self, request: aiohttp.web.Request):
@@ -114,50 +141,103 @@ class Handler:
                 "Volume": {
                     "Name": name,
                     "Mountpoint": self.driver.get_path_for(name),
-                    "Status": {
-                        "Mounted": await self.driver.is_mounted(name)
-                    }
+                    "Status": await self.driver.volume_status(name)
                 },
                 "Err": ""
             })
         except KeyError as e:
             return jsonify({"Err": f"Missing option: {e}"}, status=400)
-        except DriverError as e:
+        except (DriverError, DatabaseError) as e:
             return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_list(self, request: aiohttp.web.Request):
         logger.info(request.path)
-        return jsonify({
-            "Volumes": [{
-                "Name": name,
-                "Mountpoint": self.driver.get_path_for(name)
-            } for name in await self.driver.volumes],
-            "Err":
-            ""
-        })
+        try:
+            return jsonify({
+                "Volumes": [{
+                    "Name": name,
+                    "Mountpoint": self.driver.get_path_for(name)
+                } for name in await self.driver.volumes],
+                "Err":
+                ""
+            })
+        except DatabaseError as e:
+            return jsonify({"Err": str(e)}, status=400)
 
     async def handle_volumedriver_capabilities(self,
                                                request: aiohttp.web.Request):
         logger.info(request.path)
         return jsonify({"Capabilities": {"Scope": "global"}})
 
+    async def handle_metrics(self, request: aiohttp.web.Request):
+        return aiohttp.web.Response(text=self.driver.metrics.render())
+
+    async def handle_events(self, request: aiohttp.web.Request):
+        """
+        Streams volume state changes as server-sent events.
+        """
+        logger.info(f"{request.path} <- subscribed")
+        response = aiohttp.web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+        with self.driver.events.subscribe() as subscription:
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(subscription.get(),
+                                                       self.keepalive)
+                    except asyncio.TimeoutError:
+                        await response.write(b': keepalive\n\n')
+                        continue
+                    if event is None:
+                        break
+                    await response.write(event.encode())
+            except ConnectionResetError:
+                pass
+        logger.info(f"{request.path} <- unsubscribed")
+        return response
+
+    def _admitted(self, path: str, handler):
+        limiter = self.limiters.get(path)
+        if limiter is None:
+            return handler
+
+        async def admit(request: aiohttp.web.Request):
+            try:
+                await limiter.acquire(self.request_timeout)
+            except AdmissionError as e:
+                logger.warning(f"{request.path} -> rejected: {e}")
+                self.driver.metrics.inc("easyfuse_requests_rejected_total",
+                                        endpoint=path)
+                return jsonify({"Err": str(e)},
+                               status=503,
+                               headers={"Retry-After": "1"})
+            start = time.monotonic()
+            try:
+                return await handler(request)
+            finally:
+                limiter.release(time.monotonic() - start)
+
+        return admit
+
     def install(self, app: aiohttp.web.Application):
         app.add_routes([
-            aiohttp.web.post('/Plugin.Activate', self.handle_plugin_activate),
-            aiohttp.web.post('/VolumeDriver.Create',
-                             self.handle_volumedriver_create),
-            aiohttp.web.post('/VolumeDriver.Remove',
-                             self.handle_volumedriver_remove),
-            aiohttp.web.post('/VolumeDriver.Mount',
-                             self.handle_volumedriver_mount),
-            aiohttp.web.post('/VolumeDriver.Path',
-                             self.handle_volumedriver_path),
-            aiohttp.web.post('/VolumeDriver.Unmount',
-                             self.handle_volumedriver_unmount),
-            aiohttp.web.post('/VolumeDriver.Get',
-                             self.handle_volumedriver_get),
-            aiohttp.web.post('/VolumeDriver.List',
-                             self.handle_volumedriver_list),
-            aiohttp.web.post('/VolumeDriver.Capabilities',
-                             self.handle_volumedriver_capabilities),
+            aiohttp.web.post(path, self._admitted(path, handler))
+            for path, handler in (
+                ('/Plugin.Activate', self.handle_plugin_activate),
+                ('/VolumeDriver.Create', self.handle_volumedriver_create),
+                ('/VolumeDriver.Remove', self.handle_volumedriver_remove),
+                ('/VolumeDriver.Mount', self.handle_volumedriver_mount),
+                ('/VolumeDriver.Path', self.handle_volumedriver_path),
+                ('/VolumeDriver.Unmount', self.handle_volumedriver_unmount),
+                ('/VolumeDriver.Get', self.handle_volumedriver_get),
+                ('/VolumeDriver.List', self.handle_volumedriver_list),
+                ('/VolumeDriver.Capabilities',
+                 self.handle_volumedriver_capabilities),
+            )
+        ] + [
+            aiohttp.web.get('/metrics', self.handle_metrics),
+            aiohttp.web.get('/events', self.handle_events),
         ])
@@ -0,0 +1,86 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+# Can be removed >= Python 3.9
+from typing import Callable, Dict, Iterable, List, Tuple
+
+LabelsType = Tuple[Tuple[str, str], ...]
+SampleType = Tuple[str, Dict[str, str], float]
+
+
+def _labels(labels: dict) -> LabelsType:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _format(name: str, labels: LabelsType, value: float) -> str:
+    if labels:
+        lbl = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f"{name}{{{lbl}}} {value}"
+    return f"{name} {value}"
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry, rendered in the Prometheus text
+    exposition format.
+
+    Counters and gauges are stored directly; values that are cheaper to
+    compute on demand (e.g. breaker states) are provided by collectors,
+    called on every render.
+    """
+    def __init__(self):
+        self._counters: Dict[Tuple[str, LabelsType], float] = {}
+        self._gauges: Dict[Tuple[str, LabelsType], float] = {}
+        self._collectors: List[Callable[[], Iterable[SampleType]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Records a single observation as a `_count`/`_sum` summary pair.
+        """
+        self.inc(f"{name}_count", 1, **labels)
+        self.inc(f"{name}_sum", value, **labels)
+
+    def add_collector(self, collector: Callable[[], Iterable[SampleType]]):
+        self._collectors.append(collector)
+
+    def samples(self) -> List[Tuple[str, LabelsType, float]]:
+        result = [(name, labels, value)
+                  for (name, labels), value in self._counters.items()]
+        result += [(name, labels, value)
+                   for (name, labels), value in self._gauges.items()]
+        for collector in self._collectors:
+            result += [(name, _labels(labels), value)
+                       for name, labels, value in collector()]
+        return sorted(result)
+
+    def render(self) -> str:
+        return ''.join(
+            _format(name, labels, value) + '\n'
+            for name, labels, value in self.samples())
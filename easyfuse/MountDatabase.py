@@ -17,16 +17,41 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 
 import asyncio
+import contextlib
 import dataclasses
+import fcntl
 import json
 import logging
+import os
+import sys
+import tempfile
 
 # Can be removed >= Python 3.9
-from typing import Dict, Set
+from typing import Dict, FrozenSet, Iterable, Set
 
 logger = logging.getLogger(__name__)
 
 
+class DatabaseError(Exception):
+    pass
+
+
+def _slotted(cls):
+    """
+    Recreates a dataclass with __slots__ instead of a per-instance __dict__,
+    like dataclass(slots=True) does on Python >= 3.10.
+    """
+    names = tuple(field.name for field in dataclasses.fields(cls))
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in names + ('__dict__', '__weakref__')
+    }
+    namespace['__slots__'] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slotted
 @dataclasses.dataclass
 class MountOptions:
     device: str
@@ -34,39 +59,92 @@ class MountOptions:
     driver: str = 'fuse'
     mount_command: str = 'mount -t {driver} [-o {opts}] {device} {target}'
     unmount_command: str = 'umount {target}'
+    ready: str = ''
+    ready_timeout: str = ''
+
+    def __post_init__(self):
+        # drivers and command templates are shared by most volumes
+        self.driver = sys.intern(self.driver)
+        self.mount_command = sys.intern(self.mount_command)
+        self.unmount_command = sys.intern(self.unmount_command)
 
 
+@_slotted
 @dataclasses.dataclass
 class VolumeSpec:
     name: str
     instances: list
     opts: MountOptions
     is_mounted: bool = False
+    mountpoint: str = ''
+
+
+_VOLUME_FIELDS = frozenset(
+    field.name for field in dataclasses.fields(VolumeSpec))
+_OPTIONS_FIELDS = frozenset(
+    field.name for field in dataclasses.fields(MountOptions))
 
 
 class DatabaseJSONEncoder(json.JSONEncoder):
     def __init__(self, **kwargs):
-        super().__init__(sort_keys=True, **kwargs)
+        super().__init__(sort_keys=True, separators=(',', ':'), **kwargs)
 
     def default(self, obj: object):
-        if dataclasses.is_dataclass(obj):
-            return dataclasses.asdict(obj)
+        if isinstance(obj, (VolumeSpec, MountOptions)):
+            return {name: getattr(obj, name) for name in obj.__slots__}
         return super().default(obj)
 
 
 class DatabaseJSONDecoder(json.JSONDecoder):
-    def __init__(self, **kwargs):
-        super().__init__(object_hook=self._object_hook, **kwargs)
+    """
+    Decodes the mntdb, a JSON object mapping volume names to VolumeSpecs.
 
-    def _object_hook(self, obj: dict):
-        if VolumeSpec.__annotations__.keys() == obj.keys():
-            return VolumeSpec(**obj)
-        elif MountOptions.__annotations__.keys() == obj.keys():
-            return MountOptions(**obj)
-        return obj
+    Records are built from their known position in the document, rather than
+    by matching the keys of every decoded object against the dataclasses.
+    """
+    def decode(self, s: str) -> Dict[str, VolumeSpec]:
+        try:
+            db = super().decode(s)
+            for name, spec in db.items():
+                db[name] = self._volume(name, spec)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise DatabaseError(f"Corrupted mntdb: {e}")
+        return db
+
+    @staticmethod
+    def _known(cls, names: FrozenSet[str], name: str, spec: dict) -> dict:
+        """
+        Drops (with a warning) keys unknown to `cls`, e.g. ones written by a
+        newer version of easyfuse, rather than refusing the whole mntdb.
+        """
+        unknown = spec.keys() - names
+        logger.warning(f"Ignoring unknown {cls.__name__} key(s) of "
+                       f"volume {name}: {', '.join(sorted(unknown))}")
+        return {key: value for key, value in spec.items() if key in names}
+
+    @classmethod
+    def _volume(cls, name: str, spec: dict) -> VolumeSpec:
+        # the sets are only rebuilt for records with unknown keys
+        if not _VOLUME_FIELDS.issuperset(spec):
+            spec = cls._known(VolumeSpec, _VOLUME_FIELDS, name, spec)
+        try:
+            opts = spec['opts']
+            if not _OPTIONS_FIELDS.issuperset(opts):
+                opts = cls._known(MountOptions, _OPTIONS_FIELDS, name, opts)
+            spec['opts'] = MountOptions(**opts)
+            return VolumeSpec(**spec)
+        except (KeyError, TypeError) as e:
+            raise DatabaseError(f"Invalid record of volume {name}: {e}")
 
 
 class MountDatabase:
+    """
+    The mntdb, a JSON file mapping volume names to VolumeSpecs.
+
+    Access is serialized within the daemon by an asyncio lock and across
+    processes (e.g. with `python -m easyfuse db`) by an flock on
+    `<dbpath>.lock`; the file is always replaced atomically.
+    """
     def __init__(self, dbpath: str):
         self._lock = asyncio.Lock()
         self._path = dbpath
@@ -75,28 +153,118 @@ class MountDatabase:
         self._db: dict = None
         self._dbhash: int = 0
         self._dirty: dict = None
+        self._lockfd: int = None
 
-    async def __aenter__(self):
-        await self._lock.acquire()
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _flock(self, blocking: bool) -> bool:
+        if self._lockfd is None:
+            self._lockfd = os.open(self._path + '.lock',
+                                   os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lockfd,
+                        fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+
+    def _funlock(self):
+        fcntl.flock(self._lockfd, fcntl.LOCK_UN)
+
+    def _read(self) -> str:
         try:
             with open(self._path, 'r') as fdb:
                 s = fdb.read()
-            self._db = self._decoder.decode(s)
             logger.debug(f"Loaded mntdb {self._path} -> {s}")
         except FileNotFoundError:
             s = "{}"
-            self._db = {}
             logger.debug(f"mntdb {self._path} not found -> {s}")
+        return s
+
+    def _write(self, chunks: Iterable[str]):
+        dirname, basename = os.path.split(self._path)
+        fd, tmppath = tempfile.mkstemp(prefix=f'.{basename}.',
+                                       dir=dirname or '.')
+        try:
+            with os.fdopen(fd, 'w') as fdb:
+                for chunk in chunks:
+                    fdb.write(chunk)
+                fdb.flush()
+                os.fsync(fdb.fileno())
+            os.chmod(tmppath, 0o644)
+            os.replace(tmppath, self._path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def snapshot(self) -> Dict[str, VolumeSpec]:
+        """
+        Reads the mntdb without locking, e.g. before the event loop runs.
+        """
+        return self._decoder.decode(self._read())
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """
+        Blocking, synchronous cross-process lock of the mntdb.
+        """
+        self._flock(blocking=True)
+        try:
+            yield
+        finally:
+            self._funlock()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Blocking, synchronous access for offline tools: yields the decoded
+        mntdb and writes it back (streamed) if `save` was called on it.
+        """
+        with self.file_lock():
+            db = self._decoder.decode(self._read())
+            self._dirty = None
+            try:
+                yield db
+                if self._dirty is not None:
+                    self._write(self._encoder.iterencode(self._dirty))
+            finally:
+                self._dirty = None
+
+    def save(self, db: Dict[str, VolumeSpec]):
+        """
+        Marks `db`, as yielded by `locked`, to be written back.
+        """
+        self._dirty = db
+
+    async def __aenter__(self):
+        await self._lock.acquire()
+        try:
+            while not self._flock(blocking=False):
+                await asyncio.sleep(0.01)
+        except BaseException:
+            self._lock.release()
+            raise
+        try:
+            s = self._read()
+            self._db = self._decoder.decode(s)
+        except BaseException:
+            self._funlock()
+            self._lock.release()
+            raise
         self._dbhash = hash(s)
 
     async def __aexit__(self, exc_type, exc_value, exc_tb):
-        s = self._encoder.encode(self._db)
-        if hash(s) != self._dbhash:
-            logger.debug(f"Saving mntdb {self._path} <- {s}")
-            with open(self._path, 'w') as fdb:
-                fdb.write(s)
-        self._db = None
-        self._lock.release()
+        try:
+            s = self._encoder.encode(self._db)
+            if hash(s) != self._dbhash:
+                logger.debug(f"Saving mntdb {self._path} <- {s}")
+                self._write([s])
+        finally:
+            self._db = None
+            self._funlock()
+            self._lock.release()
 
     def __contains__(self, key):
         return key in self._db
@@ -0,0 +1,192 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import asyncio
+import dataclasses
+import logging
+import os
+
+# Can be removed >= Python 3.9
+from typing import Dict, List, Set
+
+from .mountinfo import MOUNTINFO, kernel_path, read_mountinfo
+
+logger = logging.getLogger(__name__)
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+@dataclasses.dataclass
+class ProcessStats:
+    pid: int
+    rss: int
+    cpu_seconds: float
+    fds: int
+    threads: int
+
+    def status(self) -> dict:
+        return {
+            "Pid": self.pid,
+            "RSS": self.rss,
+            "CPUSeconds": round(self.cpu_seconds, 3),
+            "FDs": self.fds,
+            "Threads": self.threads,
+        }
+
+
+def read_process_stats(pid: int, proc: str = '/proc') -> ProcessStats:
+    """
+    Samples a process from /proc/<pid>/stat and /proc/<pid>/fd, see proc(5).
+    """
+    with open(f'{proc}/{pid}/stat', 'r') as f:
+        stat = f.read()
+    # comm may contain spaces and parentheses; fields restart after the last )
+    fields = stat[stat.rindex(')') + 2:].split(' ')
+    utime, stime = int(fields[11]), int(fields[12])
+    return ProcessStats(pid=pid,
+                        rss=int(fields[21]) * PAGE_SIZE,
+                        cpu_seconds=(utime + stime) / CLK_TCK,
+                        fds=len(os.listdir(f'{proc}/{pid}/fd')),
+                        threads=int(fields[17]))
+
+
+def _read_cmdline(pid: int, proc: str) -> List[str]:
+    try:
+        with open(f'{proc}/{pid}/cmdline', 'rb') as f:
+            return [
+                os.path.normpath(arg.decode(errors='replace'))
+                for arg in f.read().split(b'\0') if arg
+            ]
+    except OSError:
+        return []
+
+
+class ResourceMonitor:
+    """
+    Periodically samples resource usage of the FUSE server processes behind
+    the mounts under `mntpath`.
+
+    The server process is identified as the process that has the mount point
+    on its command line (which holds for sshfs, rclone, s3fs and most other
+    FUSE helpers, including daemonized ones). Resolved pids are cached and
+    only revalidated on subsequent samples; /proc is fully scanned only when
+    the set of FUSE mounts changes or a resolved server goes away. Mounts
+    whose server cannot be found this way (e.g. one in another pid namespace
+    or one that rewrites its argv) are not looked up again until the set of
+    FUSE mounts changes.
+
+    Mount points are reported, and looked up, with symbolic links resolved,
+    as in mountinfo; the FUSE helpers get them below `mntpath` as given.
+    """
+    def __init__(self,
+                 mntpath: str,
+                 mountinfo: str = MOUNTINFO,
+                 proc: str = '/proc'):
+        self.mntpath = os.path.realpath(mntpath)
+        self._given = os.path.normpath(mntpath)
+        self._mountinfo = mountinfo
+        self._proc = proc
+        self._pids: Dict[str, int] = {}
+        self._scanned: Set[str] = set()
+        self._misses: Set[str] = set()
+        self.stats: Dict[str, ProcessStats] = {}
+        self._task: asyncio.Future = None
+
+    def _fuse_mounts(self) -> Set[str]:
+        prefix = self.mntpath + os.sep
+        return {
+            entry.mount_point for entry in read_mountinfo(self._mountinfo)
+            if entry.fstype.split('.', 1)[0] in ('fuse', 'fuseblk')
+            and entry.mount_point.startswith(prefix)
+        }
+
+    def _cmdline_path(self, target: str) -> str:
+        return self._given + target[len(self.mntpath):]
+
+    def _resolve(self, targets: Set[str]):
+        unresolved = {
+            target
+            for target in targets if target not in self._pids
+            or self._cmdline_path(target) not in _read_cmdline(
+                self._pids[target], self._proc)
+        }
+        for target in unresolved:
+            self._pids.pop(target, None)
+        if not unresolved or (unresolved <= self._misses
+                              and targets == self._scanned):
+            return
+        wanted = {self._cmdline_path(target): target for target in unresolved}
+        for entry in os.listdir(self._proc):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            for arg in _read_cmdline(pid, self._proc):
+                if arg in wanted:
+                    self._pids.setdefault(wanted[arg], pid)
+        self._scanned = set(targets)
+        self._misses = unresolved - self._pids.keys()
+
+    def sample(self) -> Dict[str, ProcessStats]:
+        """
+        Takes a single sample of all FUSE mounts; blocking.
+        """
+        targets = self._fuse_mounts()
+        self._resolve(targets)
+        stats = {}
+        for target in targets:
+            pid = self._pids.get(target)
+            if pid is None:
+                continue
+            try:
+                stats[target] = read_process_stats(pid, self._proc)
+            except (OSError, ValueError, IndexError):
+                self._pids.pop(target, None)
+        self._pids = {t: p for t, p in self._pids.items() if t in targets}
+        self.stats = stats
+        return stats
+
+    async def run(self, interval: float):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.sample)
+            except OSError as e:
+                logger.warning(f"Failed to sample FUSE processes: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float):
+        if interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self.run(interval))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get(self, target: str) -> ProcessStats:
+        return self.stats.get(kernel_path(target))
+
+    def collect(self):
+        for target, stats in self.stats.items():
+            labels = {"volume": os.path.basename(target)}
+            yield ("easyfuse_volume_rss_bytes", labels, stats.rss)
+            yield ("easyfuse_volume_cpu_seconds_total", labels,
+                   stats.cpu_seconds)
+            yield ("easyfuse_volume_open_fds", labels, stats.fds)
+            yield ("easyfuse_volume_threads", labels, stats.threads)
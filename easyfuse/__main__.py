@@ -22,17 +22,46 @@ import json
 import logging
 import os
 import socket
+import sys
 
+from . import db_tool
 from .Driver import Driver
 from .Handler import Handler
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be at least 0, got {value}")
+    return number
+
+
 def main(opts):
     logging.basicConfig(level=logging.INFO)
     app = aiohttp.web.Application()
     driver = Driver(opts)
-    handler = Handler(driver)
+    handler = Handler(driver,
+                      request_timeout=opts.request_timeout,
+                      mount_concurrency=opts.mount_concurrency,
+                      catalog_concurrency=opts.catalog_concurrency,
+                      queue_size=opts.queue_size)
     handler.install(app)
+
+    async def on_startup(app: aiohttp.web.Application):
+        driver.resources.start(opts.stats_interval)
+
+    async def on_shutdown(app: aiohttp.web.Application):
+        await driver.shutdown(opts.shutdown_unmount, opts.shutdown_timeout)
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
     if opts.systemd:
         SD_LISTEN_FDS_START = 3
         sock = socket.fromfd(SD_LISTEN_FDS_START, socket.AF_UNIX,
@@ -53,6 +82,49 @@ if __name__ == '__main__':
                                         "/run/easyfuse/mntpt")
     DEFAULT_MOUNT_DB = os.environ.get('EASYFUSE_MOUNT_DB',
                                       "/run/easyfuse/mntdb.json")
+    DEFAULT_MOUNT_LAYOUT = os.environ.get('EASYFUSE_MOUNT_LAYOUT', 'flat')
+    # validated by argparse, like the command line value
+    DEFAULT_MOUNT_RETRIES = os.environ.get('EASYFUSE_MOUNT_RETRIES', '2')
+    DEFAULT_RETRY_BACKOFF = float(
+        os.environ.get('EASYFUSE_RETRY_BACKOFF', 0.5))
+    DEFAULT_RETRY_BACKOFF_MAX = float(
+        os.environ.get('EASYFUSE_RETRY_BACKOFF_MAX', 10.0))
+    DEFAULT_BREAKER_THRESHOLD = int(
+        os.environ.get('EASYFUSE_BREAKER_THRESHOLD', 5))
+    DEFAULT_BREAKER_RESET = float(
+        os.environ.get('EASYFUSE_BREAKER_RESET', 30.0))
+    DEFAULT_SHUTDOWN_TIMEOUT = float(
+        os.environ.get('EASYFUSE_SHUTDOWN_TIMEOUT', 8.0))
+    DEFAULT_STATS_INTERVAL = float(
+        os.environ.get('EASYFUSE_STATS_INTERVAL', 15.0))
+    DEFAULT_MAX_ARGV_TOKENS = int(
+        os.environ.get('EASYFUSE_MAX_ARGV_TOKENS', 4096))
+    DEFAULT_MAX_ARGV_BYTES = int(
+        os.environ.get('EASYFUSE_MAX_ARGV_BYTES', 256 * 1024))
+    DEFAULT_EVENTS_QUEUE_SIZE = int(
+        os.environ.get('EASYFUSE_EVENTS_QUEUE_SIZE', 256))
+    DEFAULT_REQUEST_TIMEOUT = float(
+        os.environ.get('EASYFUSE_REQUEST_TIMEOUT', 30.0))
+    # validated by argparse, like the command line values
+    DEFAULT_MOUNT_CONCURRENCY = os.environ.get('EASYFUSE_MOUNT_CONCURRENCY',
+                                               '4')
+    DEFAULT_CATALOG_CONCURRENCY = os.environ.get(
+        'EASYFUSE_CATALOG_CONCURRENCY', '8')
+    DEFAULT_QUEUE_SIZE = int(os.environ.get('EASYFUSE_QUEUE_SIZE', 64))
+    DEFAULT_READY_CHECK = os.environ.get('EASYFUSE_READY_CHECK', 'none')
+    DEFAULT_READY_TIMEOUT = float(
+        os.environ.get('EASYFUSE_READY_TIMEOUT', 10.0))
+
+    if sys.argv[1:2] == ['db']:
+        sys.exit(
+            db_tool.main(
+                sys.argv[2:], {
+                    'mntdb': DEFAULT_MOUNT_DB,
+                    'mntpt': DEFAULT_MOUNT_PATH,
+                    'mntpt_layout': DEFAULT_MOUNT_LAYOUT,
+                    'max_argv_tokens': DEFAULT_MAX_ARGV_TOKENS,
+                    'max_argv_bytes': DEFAULT_MAX_ARGV_BYTES,
+                }))
 
     argparser = argparse.ArgumentParser('easyfuse',
                                         description="""
@@ -69,6 +141,8 @@ if __name__ == '__main__':
 
         When using systemd socket activation (-S | --systemd), PORT/HOST/SOCK
         arguments are ignored.
+
+        See `easyfuse db -h` for offline maintenance of the mount database.
         """)
     argparser.add_argument("-p",
                            "--port",
@@ -108,5 +182,128 @@ if __name__ == '__main__':
         type=str,
         help="mount database location; the location must be writeable "
         f"(default: {DEFAULT_MOUNT_DB} [EASYFUSE_MOUNT_DB])")
+    argparser.add_argument(
+        "--mntpt-layout",
+        default=DEFAULT_MOUNT_LAYOUT,
+        choices=['flat', 'hashed'],
+        help="place volumes directly in the base mount point (flat), or "
+        "spread over two levels of hashed subdirectories (hashed); mounted "
+        "volumes stay where they are until unmounted "
+        f"(default: {DEFAULT_MOUNT_LAYOUT} [EASYFUSE_MOUNT_LAYOUT])")
+    argparser.add_argument(
+        "--mount-retries",
+        default=DEFAULT_MOUNT_RETRIES,
+        type=non_negative_int,
+        help="number of times a failed mount command is retried "
+        f"(default: {DEFAULT_MOUNT_RETRIES} [EASYFUSE_MOUNT_RETRIES])")
+    argparser.add_argument(
+        "--retry-backoff",
+        default=DEFAULT_RETRY_BACKOFF,
+        type=float,
+        help="base delay in seconds of the exponential, jittered backoff "
+        "between mount retries "
+        f"(default: {DEFAULT_RETRY_BACKOFF} [EASYFUSE_RETRY_BACKOFF])")
+    argparser.add_argument(
+        "--retry-backoff-max",
+        default=DEFAULT_RETRY_BACKOFF_MAX,
+        type=float,
+        help="maximum delay in seconds between mount retries "
+        f"(default: {DEFAULT_RETRY_BACKOFF_MAX} [EASYFUSE_RETRY_BACKOFF_MAX])")
+    argparser.add_argument(
+        "--breaker-threshold",
+        default=DEFAULT_BREAKER_THRESHOLD,
+        type=int,
+        help="consecutive mount failures after which mounts from the same "
+        "device host fail fast; 0 disables the circuit breaker "
+        f"(default: {DEFAULT_BREAKER_THRESHOLD} [EASYFUSE_BREAKER_THRESHOLD])")
+    argparser.add_argument(
+        "--breaker-reset",
+        default=DEFAULT_BREAKER_RESET,
+        type=float,
+        help="seconds an open circuit breaker waits before letting a probe "
+        "mount through "
+        f"(default: {DEFAULT_BREAKER_RESET} [EASYFUSE_BREAKER_RESET])")
+    argparser.add_argument(
+        "--shutdown-timeout",
+        default=DEFAULT_SHUTDOWN_TIMEOUT,
+        type=float,
+        help="seconds to wait on shutdown for in-flight operations and "
+        "unmounts "
+        f"(default: {DEFAULT_SHUTDOWN_TIMEOUT} [EASYFUSE_SHUTDOWN_TIMEOUT])")
+    argparser.add_argument(
+        "--shutdown-unmount",
+        default=False,
+        action='store_true',
+        help="on shutdown, unmount volumes that are still mounted but are not "
+        "used by any container")
+    argparser.add_argument(
+        "--stats-interval",
+        default=DEFAULT_STATS_INTERVAL,
+        type=float,
+        help="seconds between samples of FUSE process resource usage; "
+        "0 disables sampling "
+        f"(default: {DEFAULT_STATS_INTERVAL} [EASYFUSE_STATS_INTERVAL])")
+    argparser.add_argument(
+        "--max-argv-tokens",
+        default=DEFAULT_MAX_ARGV_TOKENS,
+        type=int,
+        help="maximum number of arguments a mount/unmount command may expand "
+        "to "
+        f"(default: {DEFAULT_MAX_ARGV_TOKENS} [EASYFUSE_MAX_ARGV_TOKENS])")
+    argparser.add_argument(
+        "--max-argv-bytes",
+        default=DEFAULT_MAX_ARGV_BYTES,
+        type=int,
+        help="maximum total size in bytes a mount/unmount command may expand "
+        "to "
+        f"(default: {DEFAULT_MAX_ARGV_BYTES} [EASYFUSE_MAX_ARGV_BYTES])")
+    argparser.add_argument(
+        "--events-queue-size",
+        default=DEFAULT_EVENTS_QUEUE_SIZE,
+        type=int,
+        help="number of events buffered per /events subscriber before events "
+        "are dropped for it "
+        f"(default: {DEFAULT_EVENTS_QUEUE_SIZE} [EASYFUSE_EVENTS_QUEUE_SIZE])")
+    argparser.add_argument(
+        "--request-timeout",
+        default=DEFAULT_REQUEST_TIMEOUT,
+        type=float,
+        help="timeout of dockerd plugin calls; requests that could not be "
+        "served in time are rejected early with a retryable error "
+        f"(default: {DEFAULT_REQUEST_TIMEOUT} [EASYFUSE_REQUEST_TIMEOUT])")
+    argparser.add_argument(
+        "--mount-concurrency",
+        default=DEFAULT_MOUNT_CONCURRENCY,
+        type=positive_int,
+        help="concurrent Mount (and, separately, Unmount) requests "
+        f"(default: {DEFAULT_MOUNT_CONCURRENCY} [EASYFUSE_MOUNT_CONCURRENCY])")
+    argparser.add_argument(
+        "--catalog-concurrency",
+        default=DEFAULT_CATALOG_CONCURRENCY,
+        type=positive_int,
+        help="concurrent requests per Create/Remove/Get/List endpoint "
+        f"(default: {DEFAULT_CATALOG_CONCURRENCY} "
+        "[EASYFUSE_CATALOG_CONCURRENCY])")
+    argparser.add_argument(
+        "--queue-size",
+        default=DEFAULT_QUEUE_SIZE,
+        type=int,
+        help="requests per endpoint waiting for a slot before new ones are "
+        f"rejected (default: {DEFAULT_QUEUE_SIZE} [EASYFUSE_QUEUE_SIZE])")
+    argparser.add_argument(
+        "--ready-check",
+        default=DEFAULT_READY_CHECK,
+        choices=['none', 'mount', 'statfs'],
+        help="after mounting, wait until the volume shows up in the mount "
+        "table (mount) and also answers statfs (statfs); can be overridden "
+        "per volume with -o ready=... "
+        f"(default: {DEFAULT_READY_CHECK} [EASYFUSE_READY_CHECK])")
+    argparser.add_argument(
+        "--ready-timeout",
+        default=DEFAULT_READY_TIMEOUT,
+        type=float,
+        help="seconds to wait for a mounted volume to become ready; can be "
+        "overridden per volume with -o ready_timeout=... "
+        f"(default: {DEFAULT_READY_TIMEOUT} [EASYFUSE_READY_TIMEOUT])")
     args = argparser.parse_args()
     main(args)
@@ -0,0 +1,178 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import argparse
+import os
+import time
+
+# Can be removed >= Python 3.9
+from typing import Dict, List
+
+from .Driver import (LAYOUTS, DriverError, command_mapping, ready_opts,
+                     volume_path)
+from .MountDatabase import DatabaseError, MountDatabase, VolumeSpec
+from .parse_command import parse_command, ParserError
+
+
+def stat(mntdb: MountDatabase, args) -> int:
+    with mntdb.file_lock():
+        size = os.path.getsize(mntdb.path) if os.path.exists(
+            mntdb.path) else 0
+        start = time.perf_counter()
+        db = mntdb.snapshot()
+        decode_time = time.perf_counter() - start
+    mounted = in_use = instances = max_instances = 0
+    for vol in db.values():
+        mounted += vol.is_mounted
+        in_use += bool(vol.instances)
+        instances += len(vol.instances)
+        max_instances = max(max_instances, len(vol.instances))
+    print(f"path:        {mntdb.path}")
+    print(f"size:        {size} bytes")
+    print(f"decode time: {decode_time * 1e3:.1f} ms")
+    print(f"volumes:     {len(db)}")
+    print(f"mounted:     {mounted}")
+    print(f"in use:      {in_use}")
+    print(f"instances:   {instances} (max {max_instances} per volume)")
+    return 0
+
+
+def _validate_volume(name: str, vol: VolumeSpec, args) -> List[str]:
+    errors = []
+    if vol.name != name:
+        errors.append(f"stored under a different name ({vol.name})")
+    mapping = command_mapping(
+        vol, volume_path(args.mntpt, args.mntpt_layout, vol))
+    for field in ('mount_command', 'unmount_command'):
+        try:
+            cmd = parse_command(getattr(vol.opts, field),
+                                mapping,
+                                max_tokens=args.max_argv_tokens,
+                                max_bytes=args.max_argv_bytes)
+            if not cmd:
+                errors.append(f"{field}: empty command")
+        except ParserError as e:
+            errors.append(f"{field}: {e}")
+    try:
+        # only the volume's own settings, the daemon defaults are valid
+        ready_opts(vol.opts, 'none', 0.0)
+    except DriverError as e:
+        errors.append(str(e))
+    return errors
+
+
+def validate(mntdb: MountDatabase, args) -> int:
+    with mntdb.file_lock():
+        db = mntdb.snapshot()
+    invalid = 0
+    for name, vol in db.items():
+        errors = _validate_volume(name, vol, args)
+        invalid += bool(errors)
+        for error in errors:
+            print(f"{name}: {error}")
+    print(f"{len(db)} volume(s) checked, {invalid} invalid")
+    return 1 if invalid else 0
+
+
+def prune(mntdb: MountDatabase, args) -> int:
+    with mntdb.locked() as db:
+        unused = [
+            name for name, vol in db.items()
+            if not vol.instances and not vol.is_mounted
+        ]
+        remaining = len(db) - len(unused)
+        for name in unused:
+            print(name)
+            if not args.dry_run:
+                del db[name]
+        if unused and not args.dry_run:
+            mntdb.save(db)
+    verb = "would be pruned" if args.dry_run else "pruned"
+    print(f"{len(unused)} volume(s) {verb}, {remaining} left")
+    return 0
+
+
+def compact(mntdb: MountDatabase, args) -> int:
+    before = os.path.getsize(mntdb.path) if os.path.exists(mntdb.path) else 0
+    with mntdb.locked() as db:
+        mntdb.save(db)
+    after = os.path.getsize(mntdb.path)
+    print(f"{len(db)} volume(s) rewritten, {before} -> {after} bytes")
+    return 0
+
+
+COMMANDS = {
+    'stat': (stat, "show catalog statistics"),
+    'validate': (validate, "check the mount templates of every volume"),
+    'prune': (prune, "remove volumes that are neither mounted nor in use"),
+    'compact': (compact, "rewrite the catalog atomically, in compact form"),
+}
+
+
+def main(argv: List[str], defaults: Dict[str, object]) -> int:
+    argparser = argparse.ArgumentParser('easyfuse db',
+                                        description="""
+        Offline inspection and maintenance of the easyfuse mount database.
+        Safe to use next to a running easyfuse daemon: the database is
+        locked for the duration of each command and replaced atomically.
+        """)
+    argparser.add_argument(
+        "-d",
+        "--mntdb",
+        default=defaults['mntdb'],
+        type=str,
+        help=f"mount database location (default: {defaults['mntdb']})")
+    argparser.add_argument(
+        "-m",
+        "--mntpt",
+        default=defaults['mntpt'],
+        type=str,
+        help="base mount point, used to validate templates of unmounted "
+        f"volumes (default: {defaults['mntpt']})")
+    argparser.add_argument(
+        "--mntpt-layout",
+        default=defaults['mntpt_layout'],
+        choices=LAYOUTS,
+        help="mount point layout, used to validate templates of unmounted "
+        f"volumes (default: {defaults['mntpt_layout']})")
+    argparser.add_argument("--max-argv-tokens",
+                           default=defaults['max_argv_tokens'],
+                           type=int,
+                           help="argument count limit used by validate "
+                           f"(default: {defaults['max_argv_tokens']})")
+    argparser.add_argument("--max-argv-bytes",
+                           default=defaults['max_argv_bytes'],
+                           type=int,
+                           help="argument size limit used by validate "
+                           f"(default: {defaults['max_argv_bytes']})")
+    subparsers = argparser.add_subparsers(dest='command')
+    subparsers.required = True
+    for command, (_, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=description)
+        if command == 'prune':
+            subparser.add_argument("-n",
+                                   "--dry-run",
+                                   action='store_true',
+                                   help="only list the volumes to prune")
+    args = argparser.parse_args(argv)
+    command, _ = COMMANDS[args.command]
+    try:
+        return command(MountDatabase(args.mntdb), args)
+    except DatabaseError as e:
+        print(f"{args.mntdb}: {e}")
+        return 1
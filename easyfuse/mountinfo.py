@@ -0,0 +1,73 @@
+'''
+easyfuse - simple FUSE volume driver for Docker
+Copyright (C) 2020  Marcin Słowik
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+import re
+
+# Can be removed >= Python 3.9
+from typing import List, NamedTuple
+
+MOUNTINFO = '/proc/self/mountinfo'
+
+
+class MountEntry(NamedTuple):
+    mount_id: int
+    major: int
+    minor: int
+    mount_point: str
+    fstype: str
+    source: str
+
+
+def _unescape(field: str) -> str:
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text: str) -> List[MountEntry]:
+    """
+    Parses the contents of /proc/<pid>/mountinfo, see proc(5).
+    """
+    entries = []
+    for line in text.splitlines():
+        fields = line.split(' ')
+        try:
+            sep = fields.index('-', 6)
+            major, minor = fields[2].split(':')
+            entries.append(
+                MountEntry(int(fields[0]), int(major), int(minor),
+                           _unescape(fields[4]), fields[sep + 1],
+                           _unescape(fields[sep + 2])))
+        except (ValueError, IndexError):
+            continue
+    return entries
+
+
+def read_mountinfo(path: str = MOUNTINFO) -> List[MountEntry]:
+    with open(path, 'r') as f:
+        return parse_mountinfo(f.read())
+
+
+def kernel_path(path: str) -> str:
+    """
+    Returns `path` the way mountinfo reports it, i.e. with symbolic links
+    resolved. Only the parent directory is resolved, so that a (possibly
+    hung) mount point itself is never accessed.
+    """
+    path = os.path.normpath(path)
+    return os.path.join(os.path.realpath(os.path.dirname(path)),
+                        os.path.basename(path))
@@ -22,7 +22,7 @@ import re
 import shlex
 
 # Can be removed >= Python 3.9
-from typing import List, Union, Mapping
+from typing import Iterator, List, Union, Mapping
 
 MappingType = Mapping[str, str]
 
@@ -42,9 +42,15 @@ def _append_mapping(lst, token, mapping):
     lst.append(value)
 
 
-def parse_command(command: str, mapping: MappingType):
+def iter_command(command: str, mapping: MappingType) -> Iterator[str]:
+    """
+    Lazily expands a command template into its arguments.
+
+    Multi-line mapping values are unrolled: at the top level each line becomes
+    a separate argument, while within a bracketed group the group is repeated
+    for every combination of lines of its variables.
+    """
     parser = shlex.shlex(command, punctuation_chars=True)
-    cmd: List[List[str]] = []
     sub: List[List[str]] = None
     while True:
         token = parser.get_token()
@@ -53,7 +59,8 @@ def parse_command(command: str, mapping: MappingType):
         elif token == ']':
             if sub is None:
                 raise ParserError("misplaced ]")
-            cmd += itertools.product(*sub)
+            for group in itertools.product(*sub):
+                yield from group
             sub = None
         elif token == '[':
             if sub is not None:
@@ -66,11 +73,40 @@ def parse_command(command: str, mapping: MappingType):
             token = parser.get_token()
             if token != '}':
                 raise ParserError("missing }")
-            _append_mapping(sub if sub is not None else cmd, varname, mapping)
+            if sub is not None:
+                _append_mapping(sub, varname, mapping)
+            else:
+                value: List[List[str]] = []
+                _append_mapping(value, varname, mapping)
+                yield from value[0]
         elif sub is not None:
             sub.append([token])
         else:
-            cmd.append([token])
+            yield token
     if sub is not None:
         raise ParserError("unterminated [")
-    return [y for x in cmd for y in x]
+
+
+def parse_command(command: str,
+                  mapping: MappingType,
+                  max_tokens: int = None,
+                  max_bytes: int = None) -> List[str]:
+    """
+    Expands a command template into an argument list, see `iter_command`.
+
+    Expansion stops with a ParserError as soon as the result would exceed
+    `max_tokens` arguments or `max_bytes` bytes of argv (counting the
+    terminating NUL of every argument, as execve(2) does).
+    """
+    cmd = []
+    size = 0
+    for token in iter_command(command, mapping):
+        cmd.append(token)
+        if max_tokens is not None and len(cmd) > max_tokens:
+            raise ParserError(
+                f"command expands to more than {max_tokens} arguments")
+        size += len(token.encode()) + 1
+        if max_bytes is not None and size > max_bytes:
+            raise ParserError(
+                f"command expands to more than {max_bytes} bytes")
+    return cmd
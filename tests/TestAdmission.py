@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+
+from easyfuse.Admission import AdmissionError, Limiter
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def test_limits(self):
+        self.loop.run_until_complete(self._test_limits())
+
+    async def _test_limits(self):
+        limiter = Limiter('/VolumeDriver.Mount', concurrency=1, queue_size=1)
+        await limiter.acquire(1.0)
+        waiter = asyncio.ensure_future(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+        self.assertEqual((limiter.active, limiter.queued), (1, 1))
+        with self.assertRaises(AdmissionError) as ctx:
+            await limiter.acquire(1.0)
+        self.assertEqual(
+            str(ctx.exception),
+            '/VolumeDriver.Mount: too many pending requests, retry later.')
+        limiter.release(0.1)
+        await waiter
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+        limiter.release(0.1)
+        self.assertEqual((limiter.active, limiter.queued), (0, 0))
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            Limiter('/VolumeDriver.Mount', concurrency=0, queue_size=8)
+
+    def test_deadline(self):
+        self.loop.run_until_complete(self._test_deadline())
+
+    async def _test_deadline(self):
+        limiter = Limiter('/VolumeDriver.Mount', concurrency=1, queue_size=8)
+        await limiter.acquire(1.0)
+        with self.assertRaises(AdmissionError) as ctx:
+            await limiter.acquire(0.05)
+        self.assertIn('no slot within', str(ctx.exception))
+        self.assertEqual(limiter.queued, 0)
+        limiter.release(0.5)
+        await limiter.acquire(1.0)
+        # slots held for 0.5s on average; waiting would blow the deadline
+        limiter.service_time = 0.5
+        with self.assertRaises(AdmissionError) as ctx:
+            await limiter.acquire(0.5)
+        self.assertIn('exceeds the', str(ctx.exception))
+        self.assertEqual(limiter.queued, 0)
+
+    def test_cancel(self):
+        self.loop.run_until_complete(self._test_cancel())
+
+    async def _test_cancel(self):
+        limiter = Limiter('/VolumeDriver.Mount', concurrency=1, queue_size=8)
+        await limiter.acquire(1.0)
+        waiter = asyncio.ensure_future(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(limiter.queued, 0)
+        limiter.release(0.0)
+        self.assertEqual(limiter.active, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
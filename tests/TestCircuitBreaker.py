@@ -0,0 +1,56 @@
+import unittest
+
+from easyfuse.CircuitBreaker import (CircuitBreaker, CLOSED, HALF_OPEN, OPEN,
+                                     RetryPolicy, device_endpoint)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_device_endpoint(self):
+        self.assertEqual(device_endpoint('sshfs#user@host:/path'), 'host')
+        self.assertEqual(device_endpoint('user@host:path'), 'host')
+        self.assertEqual(device_endpoint('host:/path'), 'host')
+        self.assertEqual(device_endpoint('//host/share'), 'host')
+        self.assertEqual(device_endpoint('ftp://user@host:21/dir'), 'host')
+        self.assertEqual(device_endpoint('user@[::1]:/path'), '::1')
+        self.assertEqual(device_endpoint('/dev/sda1'), '/dev/sda1')
+
+    def test_retry_delay(self):
+        policy = RetryPolicy(attempts=5, backoff=1.0, backoff_max=3.0)
+        for attempt in range(5):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(3.0, 2**attempt))
+        with self.assertRaises(ValueError):
+            RetryPolicy(attempts=0)
+
+    def test_breaker(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        # reset_timeout=0 makes the breaker immediately half-open
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_breaker_open(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_in(), 0)
+
+    def test_breaker_disabled(self):
+        breaker = CircuitBreaker(threshold=0, reset_timeout=60)
+        for _ in range(10):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
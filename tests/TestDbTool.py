@@ -0,0 +1,90 @@
+import contextlib
+import io
+import json
+import pathlib
+import shutil
+import unittest
+
+from easyfuse import db_tool
+from easyfuse.MountDatabase import (DatabaseJSONEncoder, MountOptions,
+                                    VolumeSpec)
+
+
+class TestDbTool(unittest.TestCase):
+    def setUp(self):
+        here = pathlib.Path(__file__).parent.resolve()
+        self.testdir = here / '.test'
+        self.testdir.mkdir()
+        self.mntdb = self.testdir / 'mntdb.json'
+        db = {
+            'idle': VolumeSpec('idle', [], MountOptions('~device')),
+            'used': VolumeSpec('used', ['ffff'], MountOptions('~device'),
+                               True),
+            'bad': VolumeSpec(
+                'bad', [], MountOptions('~device',
+                                        mount_command='mount [{opts}')),
+        }
+        self.mntdb.write_text(
+            json.dumps(json.loads(DatabaseJSONEncoder().encode(db)),
+                       indent=4))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def _run(self, *argv):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rc = db_tool.main(
+                ['-d', str(self.mntdb)] + list(argv), {
+                    'mntdb': None,
+                    'mntpt': str(self.testdir / 'mntpt'),
+                    'mntpt_layout': 'flat',
+                    'max_argv_tokens': 4096,
+                    'max_argv_bytes': 256 * 1024,
+                })
+        return rc, out.getvalue().splitlines()
+
+    def test_stat(self):
+        rc, out = self._run('stat')
+        self.assertEqual(rc, 0)
+        self.assertIn('volumes:     3', out)
+        self.assertIn('mounted:     1', out)
+        self.assertIn('instances:   1 (max 1 per volume)', out)
+
+    def test_validate(self):
+        rc, out = self._run('validate')
+        self.assertEqual(rc, 1)
+        self.assertEqual(out, [
+            'bad: mount_command: unterminated [',
+            '3 volume(s) checked, 1 invalid'
+        ])
+
+    def test_corrupted(self):
+        self.mntdb.write_text('{"vol": {"name": "vol"}}')
+        for command in ('stat', 'validate', 'compact'):
+            rc, out = self._run(command)
+            self.assertEqual(rc, 1)
+            self.assertIn('Invalid record of volume vol', out[-1])
+
+    def test_prune(self):
+        rc, out = self._run('prune', '--dry-run')
+        self.assertEqual(out, ['bad', 'idle', '2 volume(s) would be pruned, '
+                               '1 left'])
+        self.assertEqual(len(json.loads(self.mntdb.read_text())), 3)
+        rc, out = self._run('prune')
+        self.assertEqual(rc, 0)
+        self.assertEqual(list(json.loads(self.mntdb.read_text())), ['used'])
+
+    def test_compact(self):
+        size = self.mntdb.stat().st_size
+        before = json.loads(self.mntdb.read_text())
+        rc, out = self._run('compact')
+        self.assertEqual(rc, 0)
+        self.assertLess(self.mntdb.stat().st_size, size)
+        self.assertEqual(json.loads(self.mntdb.read_text()), before)
+        self.assertEqual(sorted(p.name for p in self.testdir.iterdir()),
+                         ['mntdb.json', 'mntdb.json.lock'])
+
+
+if __name__ == '__main__':
+    unittest.main()
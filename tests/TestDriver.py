@@ -4,10 +4,12 @@ import pathlib
 import shlex
 import shutil
 import sys
+import threading
 import unittest
 
 from argparse import Namespace
-from easyfuse.Driver import DriverError, Driver
+from easyfuse.Driver import DriverError, Driver, STATFS_PROBES, volume_path
+from easyfuse.MountDatabase import MountOptions, VolumeSpec
 
 
 class TestDriver(unittest.TestCase):
@@ -27,6 +29,70 @@ class TestDriver(unittest.TestCase):
         self.assertEqual(str(self.mntpt / 'vol'),
                          self.driver.get_path_for('vol'))
 
+    def test_get_path_for_hashed(self):
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         mntpt_layout='hashed')
+        driver = Driver(opts)
+        # sha1('vol') = 16a0...
+        self.assertEqual(str(self.mntpt / '16' / 'a0' / 'vol'),
+                         driver.get_path_for('vol'))
+        vol = VolumeSpec('vol', [], MountOptions('~device'))
+        self.assertEqual(driver.get_path_for('vol'),
+                         volume_path(str(self.mntpt), 'hashed', vol))
+
+    def test_layout_migration(self):
+        self.loop.run_until_complete(self._test_layout_migration())
+
+    async def _test_layout_migration(self):
+        true = shutil.which('true')
+        await self.driver.volume_create('vol', {
+            'device': '~device',
+            'mount_command': true,
+            'unmount_command': true
+        })
+        await self.driver.volume_mount('vol', 'ffff')
+        flat = self.mntpt / 'vol'
+        self.assertTrue(flat.is_dir())
+        # restart with the hashed layout while vol is mounted
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         mntpt_layout='hashed')
+        self.driver = Driver(opts)
+        self.assertEqual(str(flat), self.driver.get_path_for('vol'))
+        await self.driver.volume_mount('vol', 'eeee')
+        self.assertEqual(str(flat), self.driver.get_path_for('vol'))
+        await self.driver.volume_unmount('vol', 'ffff')
+        await self.driver.volume_unmount('vol', 'eeee')
+        self.assertFalse(flat.exists())
+        hashed = self.mntpt / '16' / 'a0' / 'vol'
+        self.assertEqual(str(hashed), self.driver.get_path_for('vol'))
+        await self.driver.volume_mount('vol', 'ffff')
+        self.assertTrue(hashed.is_dir())
+        with self.mntdb.open('r') as f:
+            self.assertEqual(json.load(f)['vol']['mountpoint'], str(hashed))
+        await self.driver.volume_unmount('vol', 'ffff')
+        self.assertEqual(list(self.mntpt.iterdir()), [])
+
+    def test_volume_mount_failed_hashed(self):
+        self.loop.run_until_complete(self._test_volume_mount_failed_hashed())
+
+    async def _test_volume_mount_failed_hashed(self):
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         mntpt_layout='hashed',
+                         breaker_threshold=1)
+        self.driver = Driver(opts)
+        await self.driver.volume_create('vol', {
+            'device': 'user@host:/',
+            'mount_command': shutil.which('false')
+        })
+        # a failed command, then a rejection by the open breaker
+        for _ in range(2):
+            with self.assertRaises(DriverError):
+                await self.driver.volume_mount('vol', 'ffff')
+            self.assertEqual(list(self.mntpt.iterdir()), [])
+
     def test_volume_create(self):
         self.loop.run_until_complete(self._test_volume_create())
 
@@ -97,6 +163,281 @@ class TestDriver(unittest.TestCase):
         with dropfile_b.open('r') as f:
             self.assertEqual(f.read(), repr(args))
 
+    def test_volume_events(self):
+        self.loop.run_until_complete(self._test_volume_events())
+
+    async def _test_volume_events(self):
+        true = shutil.which('true')
+        with self.driver.events.subscribe() as events:
+            await self.driver.volume_create('vol', {
+                'device': '~device',
+                'mount_command': true,
+                'unmount_command': true
+            })
+            await self.driver.volume_mount('vol', 'ffff')
+            await self.driver.volume_unmount('vol', 'ffff')
+            await self.driver.volume_remove('vol')
+            types = [(await events.get()).type for _ in range(6)]
+        self.assertEqual(types, [
+            'created', 'mounted', 'attached', 'detached', 'unmounted',
+            'removed'
+        ])
+
+    def test_volume_mount_breaker(self):
+        self.loop.run_until_complete(self._test_volume_mount_breaker())
+
+    async def _test_volume_mount_breaker(self):
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         mount_retries=1,
+                         retry_backoff=0.0,
+                         breaker_threshold=2,
+                         breaker_reset=60.0)
+        self.driver = Driver(opts)
+        await self.driver.volume_create('vol', {'device': 'user@host:/'})
+        with self.mntdb.open('r') as f:
+            d = json.load(f)
+        d['vol']['opts']['mount_command'] = shutil.which('false')
+        with self.mntdb.open('w') as f:
+            json.dump(d, f)
+        with self.assertRaises(DriverError) as ctx:
+            await self.driver.volume_mount('vol', 'ffff')
+        self.assertIn('non-zero exit status 1', str(ctx.exception))
+        with self.assertRaises(DriverError) as ctx:
+            await self.driver.volume_mount('vol', 'ffff')
+        self.assertIn('Endpoint host is unavailable', str(ctx.exception))
+        status = await self.driver.volume_status('vol')
+        self.assertFalse(status['Mounted'])
+        self.assertEqual(status['Breaker']['Endpoint'], 'host')
+        self.assertEqual(status['Breaker']['State'], 'open')
+        self.assertEqual((await self.driver.volumes)['vol'].instances, [])
+        self.assertIn('easyfuse_breaker_state{endpoint="host"} 1',
+                      self.driver.metrics.render())
+
+    def test_volume_mount_probe_cancelled(self):
+        self.loop.run_until_complete(
+            self._test_volume_mount_probe_cancelled())
+
+    async def _test_volume_mount_probe_cancelled(self):
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         breaker_threshold=1,
+                         breaker_reset=0.0)
+        self.driver = Driver(opts)
+        await self.driver.volume_create('vol', {
+            'device': 'user@host:/',
+            'mount_command': f'{shutil.which("sleep")} 10'
+        })
+        # open the breaker; reset_timeout=0 makes it half-open right away
+        self.driver.breakers['host'].record_failure()
+        probe = asyncio.ensure_future(self.driver.volume_mount('vol', 'ffff'))
+        await asyncio.sleep(0.2)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        with self.mntdb.open('r') as f:
+            d = json.load(f)
+        d['vol']['opts']['mount_command'] = shutil.which('true')
+        with self.mntdb.open('w') as f:
+            json.dump(d, f)
+        await self.driver.volume_mount('vol', 'ffff')
+        self.assertTrue(await self.driver.is_mounted('vol'))
+        self.assertEqual(self.driver.breakers['host'].state, 'closed')
+
+    def test_volume_mount_unlocked(self):
+        self.loop.run_until_complete(self._test_volume_mount_unlocked())
+
+    async def _test_volume_mount_unlocked(self):
+        await self.driver.volume_create('vol', {
+            'device': '~device',
+            'mount_command': f'{shutil.which("sleep")} 0.5',
+            'unmount_command': shutil.which('true')
+        })
+        first = asyncio.ensure_future(self.driver.volume_mount('vol', 'ffff'))
+        await asyncio.sleep(0.1)
+        second = asyncio.ensure_future(self.driver.volume_mount('vol', 'eeee'))
+        # the mntdb stays usable while the mount command runs
+        await asyncio.wait_for(
+            self.driver.volume_create('other', {'device': '~device'}), 0.2)
+        self.assertFalse(await self.driver.is_mounted('vol'))
+        with self.assertRaises(DriverError):
+            await self.driver.volume_remove('vol')
+        await asyncio.gather(first, second)
+        volumes = await self.driver.volumes
+        self.assertTrue(volumes['vol'].is_mounted)
+        self.assertEqual(sorted(volumes['vol'].instances), ['eeee', 'ffff'])
+
+    def test_volume_mount_shared_failure(self):
+        self.loop.run_until_complete(self._test_volume_mount_shared_failure())
+
+    async def _test_volume_mount_shared_failure(self):
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.mntdb),
+                         mount_retries=2,
+                         retry_backoff=0.0)
+        self.driver = Driver(opts)
+        # count the attempts in a drop file, then fail
+        dc = ('import sys, time; open(sys.argv[1], "a").write("x"); '
+              'time.sleep(0.1); sys.exit(1)')
+        dropfile = self.testdir / 'drop'
+        await self.driver.volume_create('vol', {
+            'device': dc,
+            'mount_command': f'{sys.executable} -c {{device}} {dropfile}'
+        })
+        mounts = [
+            self.driver.volume_mount('vol', f'{i:04x}') for i in range(5)
+        ]
+        results = await asyncio.gather(*mounts, return_exceptions=True)
+        for result in results:
+            self.assertIsInstance(result, DriverError)
+            self.assertIn('non-zero exit status 1', str(result))
+        self.assertEqual(dropfile.read_text(), 'xxx')
+
+    def test_volume_mount_statfs_stuck(self):
+        self.loop.run_until_complete(self._test_volume_mount_statfs_stuck())
+
+    async def _test_volume_mount_statfs_stuck(self):
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+
+        def is_ready(target, driver, statfs):
+            # statfs on a hung FUSE mount
+            hung.wait()
+            return False
+
+        self.driver._is_ready = is_ready
+        for i in range(STATFS_PROBES + 1):
+            await self.driver.volume_create(f'vol{i}', {
+                'device': '~device',
+                'mount_command': shutil.which('true'),
+                'unmount_command': shutil.which('true'),
+                'ready': 'statfs',
+                'ready_timeout': '0.1'
+            })
+            with self.assertRaises(DriverError):
+                await self.driver.volume_mount(f'vol{i}', 'ffff')
+        self.assertEqual(len(self.driver._statfs_probes), STATFS_PROBES)
+        # the default executor is not affected
+        self.assertEqual(
+            await self.loop.run_in_executor(None, sum, [1, 2]), 3)
+
+    def test_is_ready(self):
+        self.assertTrue(Driver._is_ready('/proc', 'proc', True))
+        self.assertFalse(Driver._is_ready('/proc', 'fuse', False))
+        self.assertFalse(Driver._is_ready(str(self.mntpt), 'fuse', False))
+
+    def test_volume_mount_not_ready(self):
+        self.loop.run_until_complete(self._test_volume_mount_not_ready())
+
+    async def _test_volume_mount_not_ready(self):
+        with self.assertRaises(DriverError) as ctx:
+            await self.driver.volume_create('vol', {
+                'device': '~device',
+                'ready': 'maybe'
+            })
+        self.assertEqual(
+            str(ctx.exception), 'Invalid ready check maybe, '
+            'allowed options are none, mount, statfs')
+        await self.driver.volume_create('vol', {
+            'device': '~device',
+            'ready': 'mount',
+            'ready_timeout': '0.1'
+        })
+        with self.mntdb.open('r') as f:
+            d = json.load(f)
+        dropfile = self.testdir / 'drop'
+        d['vol']['opts']['mount_command'] = shutil.which('true')
+        d['vol']['opts']['unmount_command'] = (
+            f'{shutil.which("touch")} {dropfile}')
+        with self.mntdb.open('w') as f:
+            json.dump(d, f)
+        with self.assertRaises(DriverError) as ctx:
+            await self.driver.volume_mount('vol', 'ffff')
+        self.assertEqual(str(ctx.exception),
+                         'Volume vol not ready after 0.1s (mount check).')
+        self.assertFalse(await self.driver.is_mounted('vol'))
+        self.assertTrue(dropfile.exists())
+        self.assertEqual(list(self.mntpt.iterdir()), [])
+
+    def test_volume_mount_ready_symlink(self):
+        self.loop.run_until_complete(self._test_volume_mount_ready_symlink())
+
+    async def _test_volume_mount_ready_symlink(self):
+        # mntpt/proc resolves to /proc, which mountinfo lists as is
+        link = self.testdir / 'link'
+        link.symlink_to('/')
+        opts = Namespace(mntpt=str(link), mntdb=str(self.mntdb))
+        self.driver = Driver(opts)
+        await self.driver.volume_create('proc', {
+            'device': 'proc',
+            'driver': 'proc',
+            'mount_command': shutil.which('true'),
+            'ready': 'statfs',
+            'ready_timeout': '1'
+        })
+        await self.driver.volume_mount('proc', 'ffff')
+        self.assertTrue(await self.driver.is_mounted('proc'))
+
+    def test_shutdown(self):
+        self.loop.run_until_complete(self._test_shutdown())
+
+    async def _test_shutdown(self):
+        for name in ('idle', 'busy', 'stuck'):
+            await self.driver.volume_create(name, {'device': '~device'})
+        with self.mntdb.open('r') as f:
+            d = json.load(f)
+        true, sleep = shutil.which('true'), shutil.which('sleep')
+        for name in d:
+            d[name]['opts']['mount_command'] = true
+            d[name]['opts']['unmount_command'] = true
+        d['stuck']['opts']['unmount_command'] = f'{sleep} 10'
+        with self.mntdb.open('w') as f:
+            json.dump(d, f)
+        for name in d:
+            await self.driver.volume_mount(name, 'ffff')
+        with self.mntdb.open('r') as f:
+            d = json.load(f)
+        # simulate leftovers of failed unmounts
+        d['idle']['instances'] = []
+        d['stuck']['instances'] = []
+        with self.mntdb.open('w') as f:
+            json.dump(d, f)
+        unmounted, failed, timed_out = await self.driver.shutdown(True, 0.5)
+        self.assertEqual(unmounted, ['idle'])
+        self.assertEqual(failed, [])
+        self.assertEqual(timed_out, ['stuck'])
+        self.assertFalse(await self.driver.is_mounted('idle'))
+        self.assertTrue(await self.driver.is_mounted('busy'))
+        self.assertTrue(await self.driver.is_mounted('stuck'))
+        with self.assertRaises(DriverError) as ctx:
+            await self.driver.volume_mount('busy', 'eeee')
+        self.assertEqual(str(ctx.exception),
+                         'easyfuse is shutting down, retry later.')
+
+    def test_shutdown_locked(self):
+        self.loop.run_until_complete(self._test_shutdown_locked())
+
+    async def _test_shutdown_locked(self):
+        true, sleep = shutil.which('true'), shutil.which('sleep')
+        await self.driver.volume_create('vol', {
+            'device': '~device',
+            'mount_command': true,
+            'unmount_command': f'{sleep} 10'
+        })
+        await self.driver.volume_mount('vol', 'ffff')
+        # an unmount that holds the mntdb past the shutdown deadline
+        unmount = asyncio.ensure_future(
+            self.driver.volume_unmount('vol', 'ffff'))
+        await asyncio.sleep(0.1)
+        start = self.loop.time()
+        unmounted, failed, timed_out = await self.driver.shutdown(True, 0.3)
+        self.assertLess(self.loop.time() - start, 1.0)
+        self.assertEqual((unmounted, failed, timed_out), ([], [], []))
+        unmount.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await unmount
+        self.assertTrue(await self.driver.is_mounted('vol'))
+
     def test_volume_missing_errors(self):
         self.loop.run_until_complete(self._test_volume_missing_errors())
 
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import unittest
+
+from easyfuse import Events
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def test_encode(self):
+        event = Events.Event(7, Events.MOUNTED, {'name': 'vol'})
+        self.assertEqual(event.encode(),
+                         b'id: 7\nevent: mounted\ndata: {"name": "vol"}\n\n')
+
+    def test_publish(self):
+        self.loop.run_until_complete(self._test_publish())
+
+    async def _test_publish(self):
+        bus = Events.EventBus()
+        bus.publish(Events.CREATED, 'lost')
+        with bus.subscribe() as subscription:
+            bus.publish(Events.CREATED, 'vol')
+            bus.publish(Events.MOUNTED, 'vol', duration=0.5)
+            event = await subscription.get()
+            self.assertEqual(event.type, Events.CREATED)
+            self.assertEqual(event.data['name'], 'vol')
+            event = await subscription.get()
+            self.assertEqual(event.type, Events.MOUNTED)
+            self.assertEqual(event.data['duration'], 0.5)
+            bus.close()
+            self.assertIsNone(await subscription.get())
+        bus.publish(Events.REMOVED, 'vol')
+        self.assertTrue(subscription._queue.empty())
+
+    def test_slow_subscriber(self):
+        self.loop.run_until_complete(self._test_slow_subscriber())
+
+    async def _test_slow_subscriber(self):
+        bus = Events.EventBus(queue_size=2)
+        with bus.subscribe() as slow, bus.subscribe() as fast:
+            for i in range(5):
+                bus.publish(Events.CREATED, f'vol{i}')
+                self.assertEqual((await fast.get()).data['name'], f'vol{i}')
+            self.assertEqual((await slow.get()).data['name'], 'vol0')
+            self.assertEqual((await slow.get()).data['name'], 'vol1')
+            event = await slow.get()
+            self.assertEqual(event.type, Events.DROPPED)
+            self.assertEqual(event.data['count'], 3)
+            json.loads(event.encode().decode().split('data: ')[1])
+
+    def test_dropped_ordering(self):
+        self.loop.run_until_complete(self._test_dropped_ordering())
+
+    async def _test_dropped_ordering(self):
+        bus = Events.EventBus(queue_size=2)
+        with bus.subscribe() as subscription:
+            for i in range(4):
+                bus.publish(Events.CREATED, f'vol{i}')
+            self.assertEqual((await subscription.get()).data['name'], 'vol0')
+            # the notice takes the freed slot, ahead of newer events
+            bus.publish(Events.CREATED, 'vol4')
+            self.assertEqual((await subscription.get()).data['name'], 'vol1')
+            event = await subscription.get()
+            self.assertEqual(event.type, Events.DROPPED)
+            self.assertEqual(event.data['count'], 2)
+            event = await subscription.get()
+            self.assertEqual(event.type, Events.DROPPED)
+            self.assertEqual(event.data['count'], 1)
+            bus.publish(Events.CREATED, 'vol5')
+            self.assertEqual((await subscription.get()).data['name'], 'vol5')
+
+    def test_close_full(self):
+        self.loop.run_until_complete(self._test_close_full())
+
+    async def _test_close_full(self):
+        bus = Events.EventBus(queue_size=2)
+        with bus.subscribe() as subscription:
+            for i in range(4):
+                bus.publish(Events.CREATED, f'vol{i}')
+            bus.close()
+            self.assertEqual((await subscription.get()).data['name'], 'vol0')
+            self.assertEqual((await subscription.get()).data['name'], 'vol1')
+            event = await subscription.get()
+            self.assertEqual(event.type, Events.DROPPED)
+            self.assertEqual(event.data['count'], 2)
+            self.assertIsNone(await subscription.get())
+            self.assertIsNone(await subscription.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
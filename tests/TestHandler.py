@@ -0,0 +1,74 @@
+import aiohttp.test_utils
+import aiohttp.web
+import asyncio
+import pathlib
+import shutil
+import unittest
+
+from argparse import Namespace
+from easyfuse.Driver import Driver
+from easyfuse.Handler import Handler
+
+
+class TestHandler(unittest.TestCase):
+    def setUp(self):
+        here = pathlib.Path(__file__).parent.resolve()
+        self.testdir = here / '.test'
+        self.mntpt = self.testdir / 'mntpt'
+        opts = Namespace(mntpt=str(self.mntpt),
+                         mntdb=str(self.testdir / 'mntdb.json'))
+        self.driver = Driver(opts)
+        self.loop = asyncio.get_event_loop()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_admission(self):
+        self.loop.run_until_complete(self._test_admission())
+
+    async def _test_admission(self):
+        handler = Handler(self.driver,
+                          request_timeout=1.0,
+                          mount_concurrency=1,
+                          catalog_concurrency=1,
+                          queue_size=0)
+        app = aiohttp.web.Application()
+        handler.install(app)
+        client = aiohttp.test_utils.TestClient(
+            aiohttp.test_utils.TestServer(app))
+        await client.start_server()
+        try:
+            # occupy every limited endpoint
+            for limiter in handler.limiters.values():
+                await limiter.acquire(1.0)
+            response = await client.post('/VolumeDriver.Mount',
+                                         json={
+                                             'Name': 'vol',
+                                             'ID': 'ffff'
+                                         })
+            self.assertEqual(response.status, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            body = await response.json(content_type=None)
+            self.assertEqual(
+                body['Err'], '/VolumeDriver.Mount: too many pending '
+                'requests, retry later.')
+            self.assertIn(
+                'easyfuse_requests_rejected_total'
+                '{endpoint="/VolumeDriver.Mount"} 1',
+                self.driver.metrics.render())
+            # Path and Capabilities never queue
+            response = await client.post('/VolumeDriver.Path',
+                                         json={'Name': 'vol'})
+            self.assertEqual(response.status, 200)
+            body = await response.json(content_type=None)
+            self.assertEqual(body['Mountpoint'], str(self.mntpt / 'vol'))
+            response = await client.post('/VolumeDriver.Capabilities')
+            self.assertEqual(response.status, 200)
+            body = await response.json(content_type=None)
+            self.assertEqual(body['Capabilities'], {'Scope': 'global'})
+        finally:
+            await client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import pathlib
+import shutil
+import unittest
+
+from easyfuse.MountDatabase import (DatabaseError, DatabaseJSONDecoder,
+                                    DatabaseJSONEncoder, MountDatabase,
+                                    MountOptions, VolumeSpec)
+
+
+class TestMountDatabase(unittest.TestCase):
+    def test_roundtrip(self):
+        db = {
+            'vol': VolumeSpec('vol', ['ffff'], MountOptions('~device',
+                                                            '~opts'), True),
+            'instances': VolumeSpec('instances', [], MountOptions('~device')),
+        }
+        s = DatabaseJSONEncoder().encode(db)
+        self.assertEqual(DatabaseJSONDecoder().decode(s), db)
+
+    def test_compact(self):
+        a = VolumeSpec('a', [], MountOptions('~device'))
+        self.assertFalse(hasattr(a, '__dict__'))
+        self.assertFalse(hasattr(a.opts, '__dict__'))
+        s = DatabaseJSONEncoder().encode({'a': a, 'b': a})
+        db = DatabaseJSONDecoder().decode(s)
+        self.assertIs(db['a'].opts.mount_command, db['b'].opts.mount_command)
+        self.assertIs(db['a'].opts.driver, db['b'].opts.driver)
+
+    def test_missing_defaults(self):
+        db = DatabaseJSONDecoder().decode(
+            '{"vol": {"name": "vol", "instances": [], '
+            '"opts": {"device": "~device"}}}')
+        self.assertEqual(db['vol'],
+                         VolumeSpec('vol', [], MountOptions('~device')))
+
+    def test_unknown_keys(self):
+        with self.assertLogs('easyfuse.MountDatabase', 'WARNING'):
+            db = DatabaseJSONDecoder().decode(
+                '{"vol": {"name": "vol", "instances": [], "future": 1, '
+                '"opts": {"device": "~device", "extra": ""}}}')
+        self.assertEqual(db['vol'],
+                         VolumeSpec('vol', [], MountOptions('~device')))
+
+    def test_invalid(self):
+        for s in ('{"vol": {"name": "vol", "opts": {"device": "~device"}}}',
+                  '{"vol": {"name": "vol", "instances": [], "opts": {}}}',
+                  '{"vol": []}', '[]', '{"vol"'):
+            with self.assertRaises(DatabaseError):
+                DatabaseJSONDecoder().decode(s)
+
+    def test_corrupted_releases_lock(self):
+        testdir = pathlib.Path(__file__).parent.resolve() / '.test'
+        testdir.mkdir()
+        self.addCleanup(shutil.rmtree, testdir)
+        path = testdir / 'mntdb.json'
+        path.write_text('{"vol": {"name": "vol"}}')
+        mntdb = MountDatabase(str(path))
+
+        async def access():
+            async with mntdb:
+                pass
+
+        loop = asyncio.get_event_loop()
+        for _ in range(2):
+            with self.assertRaises(DatabaseError):
+                loop.run_until_complete(asyncio.wait_for(access(), 1))
+        # the cross-process lock is released as well
+        self.assertTrue(MountDatabase(str(path))._flock(blocking=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
+import itertools
 import unittest
 
-from easyfuse.parse_command import parse_command, ParserError
+from easyfuse.parse_command import iter_command, parse_command, ParserError
 
 
 class TestParseCommand(unittest.TestCase):
@@ -38,6 +39,43 @@ class TestParseCommand(unittest.TestCase):
         self.assertEqual(
             cmd, ['command', 'tag', 'value1', 'tag', 'value2', 'value3'])
 
+    def test_parse_unroll_product(self):
+        cmd = parse_command('command [-o {a}={b}] {c}', {
+            'a': 'a1\na2',
+            'b': 'b1\nb2',
+            'c': 'c1\nc2'
+        })
+        self.assertEqual(cmd, [
+            'command', '-o', 'a1', '=', 'b1', '-o', 'a1', '=', 'b2', '-o',
+            'a2', '=', 'b1', '-o', 'a2', '=', 'b2', 'c1', 'c2'
+        ])
+
+    def test_iter_command_lazy(self):
+        opts = '\n'.join(str(i) for i in range(1000))
+        it = iter_command('command [{a} {b} {c}]', {
+            'a': opts,
+            'b': opts,
+            'c': opts
+        })
+        self.assertEqual(list(itertools.islice(it, 4)),
+                         ['command', '0', '0', '0'])
+
+    def test_limits(self):
+        mapping = {'a': '\n'.join(str(i) for i in range(1000))}
+        mapping['b'] = mapping['a']
+        with self.assertRaises(ParserError) as ctx:
+            parse_command('command [-o {a} {b}]', mapping, max_tokens=100)
+        self.assertEqual(str(ctx.exception),
+                         'command expands to more than 100 arguments')
+        with self.assertRaises(ParserError) as ctx:
+            parse_command('command [-o {a} {b}]', mapping, max_bytes=100)
+        self.assertEqual(str(ctx.exception),
+                         'command expands to more than 100 bytes')
+        cmd = parse_command('command argument', {},
+                            max_tokens=2,
+                            max_bytes=len('command argument') + 1)
+        self.assertEqual(cmd, ['command', 'argument'])
+
     def test_errors(self):
         with self.assertRaises(ParserError) as ctx:
             parse_command('cmd [tag', {})
@@ -0,0 +1,104 @@
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+
+from easyfuse.mountinfo import parse_mountinfo
+from easyfuse.ResourceMonitor import ResourceMonitor, read_process_stats
+
+MOUNTINFO = """\
+22 1 0:21 / /proc rw,nosuid,nodev,noexec,relatime shared:12 - proc proc rw
+98 29 0:52 / {mntpt}/vol rw,nosuid,nodev,relatime shared:50 - fuse.sshfs user@host:/ rw,user_id=0,group_id=0
+99 29 0:53 / {mntpt}/with\\040space rw,relatime - fuse rclone:bucket rw
+100 29 0:54 / /elsewhere rw,relatime - fuse.sshfs user@host:/ rw
+"""
+
+
+class TestResourceMonitor(unittest.TestCase):
+    def setUp(self):
+        here = pathlib.Path(__file__).parent.resolve()
+        self.testdir = here / '.test'
+        self.mntpt = self.testdir / 'mntpt'
+        self.mountinfo = self.testdir / 'mountinfo'
+        self.mntpt.mkdir(parents=True)
+        self.mountinfo.write_text(MOUNTINFO.format(mntpt=self.mntpt))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_parse_mountinfo(self):
+        entries = parse_mountinfo(MOUNTINFO.format(mntpt='/mnt'))
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[1].mount_point, '/mnt/vol')
+        self.assertEqual((entries[1].major, entries[1].minor), (0, 52))
+        self.assertEqual(entries[1].fstype, 'fuse.sshfs')
+        self.assertEqual(entries[1].source, 'user@host:/')
+        self.assertEqual(entries[2].mount_point, '/mnt/with space')
+
+    def test_read_process_stats(self):
+        stats = read_process_stats(os.getpid())
+        self.assertEqual(stats.pid, os.getpid())
+        self.assertGreater(stats.rss, 0)
+        self.assertGreater(stats.fds, 0)
+        self.assertGreaterEqual(stats.threads, 1)
+
+    def test_sample(self):
+        self._test_sample(self.mntpt)
+
+    def test_sample_symlink(self):
+        link = self.testdir / 'link'
+        link.symlink_to(self.mntpt)
+        self._test_sample(link)
+
+    def _test_sample(self, mntpt: pathlib.Path):
+        target = str(self.mntpt / 'vol')
+        # stand-in for a FUSE helper, with the mount point on its cmdline
+        arg = str(mntpt / 'vol')
+        proc = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.stdin.read()', arg],
+            stdin=subprocess.PIPE)
+        try:
+            # wait for the child to exec
+            cmdline = pathlib.Path(f'/proc/{proc.pid}/cmdline')
+            while arg.encode() not in cmdline.read_bytes():
+                time.sleep(0.01)
+            monitor = ResourceMonitor(str(mntpt), str(self.mountinfo))
+            stats = monitor.sample()
+            self.assertEqual(set(stats), {target})
+            self.assertEqual(stats[target].pid, proc.pid)
+            self.assertEqual(monitor.get(arg + '/').pid, proc.pid)
+            samples = list(monitor.collect())
+            self.assertIn(('easyfuse_volume_threads', {
+                'volume': 'vol'
+            }, stats[target].threads), samples)
+        finally:
+            proc.communicate()
+        self.assertEqual(monitor.sample(), {})
+
+    def test_unresolved(self):
+        proc = self.testdir / 'proc'
+        proc.mkdir()
+        monitor = ResourceMonitor(str(self.mntpt), str(self.mountinfo),
+                                  str(proc))
+        self.assertEqual(monitor.sample(), {})
+        # a server that shows up later is not looked for on every sample
+        helper = proc / '123'
+        (helper / 'fd').mkdir(parents=True)
+        (helper / 'stat').write_text('123 (helper) S' + ' 0' * 30)
+        (helper / 'cmdline').write_bytes(
+            f'sshfs\0{self.mntpt}/vol\0'.encode())
+        self.assertEqual(monitor.sample(), {})
+        # ... only once the set of FUSE mounts changes
+        self.mountinfo.write_text(''.join(
+            line for line in MOUNTINFO.format(
+                mntpt=self.mntpt).splitlines(keepends=True)
+            if 'rclone' not in line))
+        stats = monitor.sample()
+        self.assertEqual(stats[str(self.mntpt / 'vol')].pid, 123)
+
+
+if __name__ == '__main__':
+    unittest.main()
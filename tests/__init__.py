@@ -1,2 +1,9 @@
+from .TestAdmission import TestAdmission
+from .TestCircuitBreaker import TestCircuitBreaker
+from .TestDbTool import TestDbTool
 from .TestDriver import TestDriver
+from .TestEvents import TestEvents
+from .TestHandler import TestHandler
+from .TestMountDatabase import TestMountDatabase
 from .TestParseCommand import TestParseCommand
+from .TestResourceMonitor import TestResourceMonitor
@@ -1,7 +1,14 @@
 import unittest
 
+from .TestAdmission import TestAdmission
+from .TestCircuitBreaker import TestCircuitBreaker
+from .TestDbTool import TestDbTool
 from .TestDriver import TestDriver
+from .TestEvents import TestEvents
+from .TestHandler import TestHandler
+from .TestMountDatabase import TestMountDatabase
 from .TestParseCommand import TestParseCommand
+from .TestResourceMonitor import TestResourceMonitor
 
 if __name__ == '__main__':
     unittest.main()